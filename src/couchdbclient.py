@@ -1,14 +1,174 @@
 from config import Config
+import copy
 import couchdb
 import os
-from typing import List, Dict, Any, Optional
+import itertools
+import threading
+from typing import List, Dict, Any, Optional, Tuple, Iterable, Iterator, Callable
 
 DEBUG = os.getenv("DEBUG", "0") in ("1", "true", "True")
+# local documents are not replicated, they hold per-database sync state
+CHECKPOINT_DOC = "_local/dg-openheidelberg"
+DEFAULT_BULK_BATCH_SIZE = 100
+# values per $in selector and docs per _find page for batch lookups
+FIND_BATCH_SIZE = 200
+DEFAULT_VIEW_BATCH_SIZE = 100
+DEFAULT_CHANGES_BATCH_SIZE = 100
+# design document holding the Mango indexes created by ensure_indexes
+INDEX_DDOC = "dg-openheidelberg-indexes"
+# index name -> index definition
+# the partial indexes serve the $exists: false queries, which need "_id": {"$gt": None} in their selector
+INDEXES: Dict[str, Dict[str, Any]] = {
+    'member-id': {'fields': ['member_id']},
+    'email': {'fields': ['email']},
+    'nextcloud-id': {'fields': ['nextcloud.nextcloud_id']},
+    'openproject-id': {'fields': ['openproject.openproject_id']},
+    'without-member-id': {'fields': ['_id'],
+                          'partial_filter_selector': {'member_id': {'$exists': False}}},
+    'without-openproject': {'fields': ['_id'],
+                            'partial_filter_selector': {'openproject': {'$exists': False}}},
+}
+# document field -> index used for lookups on that field
+FIELD_INDEXES = {
+    'member_id': 'member-id',
+    'email': 'email',
+    'nextcloud.nextcloud_id': 'nextcloud-id',
+    'openproject.openproject_id': 'openproject-id',
+}
+
+
+def chunked(iterable: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """
+    Split an iterable into lists of at most size items.
+    """
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+def get_field(doc: Dict[str, Any], path: str) -> Any:
+    """
+    Read a dotted field path like 'nextcloud.nextcloud_id' from a document.
+    """
+    value: Any = doc
+    for key in path.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+class TrackedDocument(couchdb.Document):
+    """
+    CouchDB document that remembers its content as loaded,
+    so documents without changes can be skipped on save.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.original = copy.deepcopy(dict(self))
+
+    @property
+    def changed(self) -> bool:
+        """True if the content differs from the loaded or last saved version."""
+        return dict(self) != self.original
+
+    def changed_fields(self) -> List[str]:
+        """Names of the fields added, removed or modified since loading."""
+        return [key for key in set(self) | set(self.original)
+                if key not in self or key not in self.original or self[key] != self.original[key]]
+
+    def mark_saved(self) -> None:
+        """Take the current content as the new baseline."""
+        self.original = copy.deepcopy(dict(self))
+
+
+class BulkWriter:
+    """
+    Buffer modified documents and write them with _bulk_docs in batches.
+    Use as a context manager so the last partial batch is flushed:
+        with client.bulk_writer() as writer:
+            writer.save(doc)
+    """
+
+    def __init__(self, db: couchdb.Database, batch_size: int = DEFAULT_BULK_BATCH_SIZE):
+        self.db = db
+        self.batch_size = max(batch_size, 1)
+        self.pending: Dict[Any, Dict[str, Any]] = {}
+        self.revisions: Dict[str, str] = {}
+        self.conflicts: Dict[str, Exception] = {}
+        self.saved = 0
+        self.skipped = 0
+        self.lock = threading.Lock()
+
+    def save(self, doc: Dict[str, Any]) -> None:
+        """
+        Queue a document for writing, flushing when a batch is full.
+        Queuing another version of an already queued document flushes first.
+        Unchanged TrackedDocuments are skipped.
+        """
+        key = doc.get('_id') or id(doc)
+        with self.lock:
+            if isinstance(doc, TrackedDocument) and not doc.changed:
+                self.skipped += 1
+                return
+            if key in self.pending and self.pending[key] is not doc:
+                self._flush()
+            self.pending[key] = doc
+            if len(self.pending) >= self.batch_size:
+                self._flush()
+
+    def flush(self) -> List[Tuple[bool, str, Any]]:
+        """
+        Write all queued documents.
+        Returns:
+            (success, doc_id, rev_or_exception) per document, see couchdb.Database.update
+        """
+        with self.lock:
+            return self._flush()
+
+    def _flush(self) -> List[Tuple[bool, str, Any]]:
+        if not self.pending:
+            return []
+        batch = list(self.pending.values())
+        self.pending = {}
+        results = self.db.update(batch)
+        for doc, (success, doc_id, rev_or_exc) in zip(batch, results):
+            if success:
+                self.saved += 1
+                self.revisions[doc_id] = rev_or_exc
+                if isinstance(doc, TrackedDocument):
+                    doc.mark_saved()
+            else:
+                self.conflicts[doc_id] = rev_or_exc
+                print(f"Failed to save document {doc_id}: {rev_or_exc}")
+        return results
+
+    def summary(self) -> Dict[str, int]:
+        """Counts of saved, skipped (unchanged) and conflicting documents."""
+        with self.lock:
+            return {
+                'saved': self.saved,
+                'skipped': self.skipped,
+                'conflicts': len(self.conflicts),
+                'pending': len(self.pending)
+            }
+
+    def __enter__(self) -> "BulkWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.flush()
 
 class Client:
     """
     A simple CouchDB client to interact with a CouchDB database.
     """
+    # sequence reached by the last iter_changes call
+    changes_seq: Any = None
+    # databases whose indexes were ensured by this process
+    _indexed: set = set()
+    _indexed_lock = threading.Lock()
 
     def __init__(self, config: Optional[Dict[str, Any]] = None):
         """
@@ -30,6 +190,62 @@ class Client:
             print(f"**couch config**: {self.config}")
         self.server = couchdb.Server(server_url)
         self.db = self.server[database_name]
+        if self.config.get('ensure_indexes', True):
+            with Client._indexed_lock:
+                if (server_url, database_name) not in Client._indexed:
+                    try:
+                        self.ensure_indexes()
+                    except Exception as e:
+                        # creating indexes needs admin rights, queries still work without them
+                        print(f"Could not create indexes on {database_name}: {e}. Queries fall back to full scans.")
+                    Client._indexed.add((server_url, database_name))
+
+    def ensure_indexes(self) -> Dict[str, str]:
+        """
+        Create the Mango indexes used by the queries of this client.
+        Creating an existing index is a no-op in CouchDB, so this is safe to repeat.
+        Returns:
+            index name -> "created" or "exists"
+        """
+        results = {}
+        for name, index in INDEXES.items():
+            _, _, data = self.db.resource.post_json('_index', body={
+                'index': index,
+                'ddoc': INDEX_DDOC,
+                'name': name,
+                'type': 'json'
+            })
+            results[name] = data.get('result', '')
+        return results
+
+    @staticmethod
+    def mango_query(index: str, selector: Dict[str, Any], **options) -> Dict[str, Any]:
+        """
+        Build a Mango query hinting the index declared for it in INDEXES.
+        """
+        return {"selector": selector, "use_index": [INDEX_DDOC, index], **options}
+
+    def check_indexes(self) -> List[str]:
+        """
+        Explain a representative query per index.
+        Returns:
+            names of the queries CouchDB would still answer with a full scan
+        """
+        selectors = {
+            'member-id': {"member_id": {"$eq": 0}},
+            'email': {"email": {"$eq": ""}},
+            'nextcloud-id': {"nextcloud.nextcloud_id": {"$eq": ""}},
+            'openproject-id': {"openproject.openproject_id": {"$eq": 0}},
+            'without-member-id': {"_id": {"$gt": None}, "member_id": {"$exists": False}},
+            'without-openproject': {"_id": {"$gt": None}, "openproject": {"$exists": False}},
+        }
+        unindexed = []
+        for name, selector in selectors.items():
+            plan = self.db.explain(self.mango_query(name, selector))
+            if plan.get('index', {}).get('type') == 'special':
+                print(f"Query {name} runs without an index")
+                unindexed.append(name)
+        return unindexed
 
     @staticmethod
     def mango_filter_by_email(email: str) -> dict:
@@ -46,12 +262,11 @@ class Client:
             List of documents without the 'openpromember_idject' key
         """
         # Mango query: find docs where 'member_id' does not exist
-        mango_query = {"selector": 
-            {"member_id": 
-                {"$exists": False}
-                }
-            }
-        result = self.db.find(mango_query)
+        mango_query = self.mango_query('without-member-id', {
+            "_id": {"$gt": None},
+            "member_id": {"$exists": False}
+        })
+        result = self.db.find(mango_query, wrapper=TrackedDocument)
         return list(result)
     
     def get_doc_by_member_id(self, member_id: str):
@@ -61,54 +276,42 @@ class Client:
         except ValueError:
             print(f"Invalid member_id: {member_id}. It should be an integer.")
             return
-        mango_query = {
-            "selector": {
-                "member_id": {
+        mango_query = self.mango_query('member-id', {
+            "member_id": {
                 "$eq": mid
-                }
             }
-        }
-        result = self.db.find(mango_query)
+        })
+        result = self.db.find(mango_query, wrapper=TrackedDocument)
         return list(result)
     
     def get_doc_by_email(self, email: str):
         """Find doc by email"""
-        mango_query = {
-            "selector": {
-                "email": {
-                    "$eq": email
-                }
+        mango_query = self.mango_query('email', {
+            "email": {
+                "$eq": email
             }
-        }
-        result = self.db.find(mango_query)
+        })
+        result = self.db.find(mango_query, wrapper=TrackedDocument)
         return list(result) if result else None
 
     def get_doc_by_nextcloud_id(self, nextcloud_id):
         """Find doc by nextcloud_id"""
-        mango_query = {
-            "selector": {
-                "nextcloud": {
-                   "nextcloud_id": {
-                       "$eq": nextcloud_id
-                   }
-               }
+        mango_query = self.mango_query('nextcloud-id', {
+            "nextcloud.nextcloud_id": {
+                "$eq": nextcloud_id
             }
-        }
-        result = self.db.find(mango_query)
+        })
+        result = self.db.find(mango_query, wrapper=TrackedDocument)
         return list(result) if result else None
     
     def get_doc_by_openproject_id(self, openproject_id):
         """Find doc by openproject_id"""
-        mango_query = {
-            "selector": {
-                "openproject": {
-                   "openproject_id": {
-                       "$eq": openproject_id
-                   }
-               }
+        mango_query = self.mango_query('openproject-id', {
+            "openproject.openproject_id": {
+                "$eq": openproject_id
             }
-        }
-        result = self.db.find(mango_query)
+        })
+        result = self.db.find(mango_query, wrapper=TrackedDocument)
         return list(result) if result else None
 
     def get_docs_without_openproject_key(self) -> List[Dict[str, Any]]:
@@ -119,19 +322,180 @@ class Client:
         """
         
         # Mango query: find docs where 'openproject' does not exist
-        mango_query = {"selector": 
-            {"openproject": 
-                {"$exists": False}
-                }
-            }
-        result = self.db.find(mango_query)
+        mango_query = self.mango_query('without-openproject', {
+            "_id": {"$gt": None},
+            "openproject": {"$exists": False}
+        })
+        result = self.db.find(mango_query, wrapper=TrackedDocument)
         return list(result)
 
+    def iter_all_docs(self,
+                      batch_size: Optional[int] = None,
+                      fields: Optional[List[str]] = None,
+                      include_docs: bool = True) -> Iterator[Dict[str, Any]]:
+        """
+        Yield all documents excluding design documents, fetching them in batches.
+        Only one batch is held in memory at a time.
+        Args:
+            batch_size: rows per request, defaults to view_batch_size from the couchdb config
+            fields: only return these fields (plus _id and _rev) as plain dicts,
+                    such partial documents must not be saved back
+            include_docs: if False, only _id and _rev are read from _all_docs
+        Returns:
+            iterator of TrackedDocument, or of plain dicts when fields or include_docs=False are given
+        """
+        batch = batch_size or self.config.get('view_batch_size', DEFAULT_VIEW_BATCH_SIZE)
+        if not include_docs:
+            for row in self.db.iterview('_all_docs', batch):
+                if not row.id.startswith('_design/'):
+                    yield {'_id': row.id, '_rev': row.value['rev']}
+            return
+        for row in self.db.iterview('app/all_entries', batch):
+            if fields:
+                yield {key: row.value[key] for key in ['_id', '_rev', *fields] if key in row.value}
+            else:
+                yield TrackedDocument(row.value)
+
     def get_all_docs(self) -> List[Dict[str, Any]]:
         """
         Fetch all documents from the CouchDB database excluding design documents.
+        Prefer iter_all_docs for large databases.
         Returns:
             List of all documents in the database
         """
-        rows = self.db.view('app/all_entries')
-        return [row.value for row in rows]
+        return list(self.iter_all_docs())
+
+    def iter_changes(self,
+                     since: Any = None,
+                     batch_size: Optional[int] = None,
+                     selector: Optional[Dict[str, Any]] = None) -> Iterator[TrackedDocument]:
+        """
+        Yield the documents changed since a sequence, reading _changes in batches.
+        Deleted and design documents are skipped. The sequence reached is kept in
+        self.changes_seq, persist it with set_checkpoint once the changes are processed.
+        Args:
+            since: sequence to start from, defaults to the 'changes_since' checkpoint
+            batch_size: changes per request, defaults to changes_batch_size from the couchdb config
+            selector: optional Mango selector evaluated by CouchDB (_selector filter)
+        """
+        if since is None:
+            since = self.get_checkpoint('changes_since', 0)
+        batch = batch_size or self.config.get('changes_batch_size', DEFAULT_CHANGES_BATCH_SIZE)
+        self.changes_seq = since
+        while True:
+            options: Dict[str, Any] = {'since': since, 'include_docs': True, 'limit': batch}
+            if selector:
+                options.update(filter='_selector', _selector={'selector': selector})
+            data = self.db.changes(**options)
+            results = data.get('results', [])
+            for change in results:
+                if change.get('deleted') or change['id'].startswith('_design/'):
+                    continue
+                yield TrackedDocument(change['doc'])
+            since = data.get('last_seq', since)
+            self.changes_seq = since
+            if len(results) < batch:
+                break
+
+    def get_checkpoint(self, name: str, default: Any = None) -> Any:
+        """
+        Read a persisted sync checkpoint, e.g. a watermark or sequence.
+        Args:
+            name: checkpoint name
+            default: value returned if the checkpoint was never set
+        """
+        doc = self.db.get(CHECKPOINT_DOC)
+        if doc is None:
+            return default
+        return doc.get(name, default)
+
+    def set_checkpoint(self, name: str, value: Any) -> None:
+        """
+        Persist a sync checkpoint in a local (non replicated) document.
+        Args:
+            name: checkpoint name
+            value: JSON serializable value
+        """
+        doc = self.db.get(CHECKPOINT_DOC) or {'_id': CHECKPOINT_DOC}
+        doc[name] = value
+        self.db.save(doc)
+
+    def bulk_writer(self, batch_size: Optional[int] = None) -> BulkWriter:
+        """
+        Create a buffered writer for this database.
+        Args:
+            batch_size: documents per _bulk_docs request,
+                        defaults to bulk_batch_size from the couchdb config
+        """
+        return BulkWriter(self.db, batch_size or self.config.get('bulk_batch_size', DEFAULT_BULK_BATCH_SIZE))
+
+    def find_all(self,
+                 selector: Dict[str, Any],
+                 page_size: int = FIND_BATCH_SIZE,
+                 index: Optional[str] = None) -> Iterator[TrackedDocument]:
+        """
+        Yield every document matching a Mango selector.
+        _find returns at most `limit` documents, further pages are requested with the bookmark.
+        Args:
+            selector: Mango selector
+            page_size: documents per _find request
+            index: name of the INDEXES entry to hint with use_index
+        """
+        query = self.mango_query(index, selector, limit=page_size) if index else \
+            {"selector": selector, "limit": page_size}
+        while True:
+            _, _, data = self.db.resource.post_json('_find', body=query)
+            if data.get('warning'):
+                print(f"CouchDB warning for {selector}: {data['warning']}")
+            docs = data.get('docs', [])
+            for doc in docs:
+                yield TrackedDocument(doc)
+            if len(docs) < page_size or not data.get('bookmark'):
+                break
+            query['bookmark'] = data['bookmark']
+
+    def get_docs_by_values(self,
+                           field: str,
+                           values: Iterable[Any],
+                           cast: Optional[Callable[[Any], Any]] = None) -> Dict[Any, List[TrackedDocument]]:
+        """
+        Resolve many lookup values with one $in query per FIND_BATCH_SIZE values.
+        Args:
+            field: document field, dotted for nested fields
+            values: values to look up, duplicates and empty values are ignored
+            cast: optional conversion applied to the values before querying
+        Returns:
+            dict of lookup value -> list of matching documents, values without match are missing
+        """
+        wanted = []
+        for value in values:
+            if value in (None, ''):
+                continue
+            if cast:
+                try:
+                    value = cast(value)
+                except ValueError:
+                    print(f"Invalid {field}: {value}")
+                    continue
+            wanted.append(value)
+        result: Dict[Any, List[TrackedDocument]] = {}
+        for batch in chunked(dict.fromkeys(wanted), FIND_BATCH_SIZE):
+            for doc in self.find_all({field: {"$in": batch}}, index=FIELD_INDEXES.get(field)):
+                result.setdefault(get_field(doc, field), []).append(doc)
+        return result
+
+    def get_docs_by_member_ids(self, member_ids: Iterable[Any]) -> Dict[int, List[TrackedDocument]]:
+        """Find docs for many member_ids, keyed by int member_id"""
+        return self.get_docs_by_values('member_id', member_ids, cast=int)
+
+    def get_docs_by_emails(self, emails: Iterable[str]) -> Dict[str, List[TrackedDocument]]:
+        """Find docs for many emails, keyed by email"""
+        return self.get_docs_by_values('email', emails)
+
+    def get_docs_by_nextcloud_ids(self, nextcloud_ids: Iterable[str]) -> Dict[str, List[TrackedDocument]]:
+        """Find docs for many nextcloud_ids, keyed by nextcloud_id"""
+        return self.get_docs_by_values('nextcloud.nextcloud_id', nextcloud_ids)
+
+    def get_docs_by_openproject_ids(self, openproject_ids: Iterable[Any]) -> Dict[Any, List[TrackedDocument]]:
+        """Find docs for many openproject_ids, keyed by openproject_id"""
+        return self.get_docs_by_values('openproject.openproject_id', openproject_ids)
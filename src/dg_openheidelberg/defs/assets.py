@@ -1,8 +1,14 @@
 import dagster as dg
 import json
-from couchdbclient import Client
-from openproject import WorkPackageParser, UserParser, CUSTOMFIELD, STATUS
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from config import Config
+from couchdbclient import Client, chunked, FIND_BATCH_SIZE
+from openproject import WorkPackageParser, UserParser, CUSTOMFIELD, STATUS, TASK_FIELDS
 from nextcloud import NextcloudClient
+from onboarding import blank, generate_usernames, normalize_umlauts
+
+DEFAULT_ACCOUNT_WORKERS = 4
 
 # TODO: move config loading to a central place
 # load config
@@ -11,22 +17,9 @@ from nextcloud import NextcloudClient
 wp = WorkPackageParser()
 up = UserParser()
 next_client = NextcloudClient()
-
-def replace_umlauts(text: str) -> str:
-    """replace special German umlauts (vowel mutations) from text. 
-    ä -> ae, Ä -> Ae...
-    ü -> ue, Ü -> Ue...
-    ö -> oe, Ö -> Oe...
-    ß -> ss
-    """
-    vowel_char_map = {
-        ord('ä'): 'ae', ord('ü'): 'ue', ord('ö'): 'oe', ord('ß'): 'ss',
-        ord('Ä'): 'Ae', ord('Ü'): 'Ue', ord('Ö'): 'Oe'
-    }
-    return text.translate(vowel_char_map)
+accounts_config = Config().get('accounts')
 
 
-        
 # CREATE MEMBER TASKS PIPELINE
 @dg.asset(name='create_openproject_member_tasks',
           group_name="initialisation",
@@ -37,13 +30,23 @@ def create_openproject_member_tasks():
     #initialize couchdb client
     client = Client()
     # Fetch documents without 'openproject' key
-    docs = client.get_docs_without_member_id()
-    for doc in docs:
-        doc = fix_doc_id(doc)
-        if not doc.get('username'):
-            username = f"{doc.get('firstname', '')[0]}{doc.get('lastname', '')}".lower().replace(" ", "")
-            doc['username'] = username
-            
+    docs = [fix_doc_id(doc) for doc in client.get_docs_without_member_id()]
+    if not docs:
+        return {"status": "success", "message": "No new users to initialize."}
+    # Generate missing usernames for all docs at once, avoiding existing OpenProject and Nextcloud logins
+    frame = pd.DataFrame(docs, columns=['username', 'firstname', 'lastname'])
+    taken = []
+    if blank(frame['username']).any():
+        # the logins are only needed to generate usernames, Nextcloud ids come from one list request
+        taken = [user['login'] for user in up.iter_users()] + next_client.get_user_ids()
+    usernames = generate_usernames(frame, taken=taken)
+    for doc, username, clash in zip(docs, usernames['username'], usernames['clash']):
+        if pd.isna(username):
+            print(f"No username and no name for {doc['_id']}, skipping")
+            continue
+        if clash:
+            print(f"Username {username} of {doc['_id']} is already taken")
+        doc['username'] = username
         member = wp.initialize_member_from_doc(doc=doc)
         if member:
             doc['member_id'] = member['id']
@@ -54,28 +57,25 @@ def create_openproject_member_tasks():
     
 # CREATE ACCOUNTS PIPELINES
 
-@dg.asset(group_name="account",
-          description="op->>opu op->>next\n Create accounts")
-def create_user_accounts():
-    # Load OpenProject tasks with status 'scheduled'
-    client = Client()
-    tasks = wp.get_workpackages(status_id=STATUS['Scheduled'], project_id=18)
-    if not tasks:
-        return "No tasks found with status 'scheduled' in OpenProject"
-    for task in tasks:
-        # Get couchdb entry
-        docs = client.get_doc_by_member_id(member_id=task['id'])
+def provision_account(task: dict, docs: list, writer) -> str:
+    """
+    Create the OpenProject and Nextcloud accounts requested by one scheduled task.
+    The steps of a task run in order, tasks are independent of each other.
+    Comments and status changes are collected and sent to OpenProject once at the end.
+    If a step raises, only the comments are sent, the task keeps its status and is retried.
+    :return: 'created' or 'rejected' if the CouchDB document is missing or ambiguous
+    """
+    changes = wp.changes(task)
+    try:
         if not docs:
-            wp.add_comment(member_id=task['id'], comment="No CouchDB document found for this member\n Something went wrong")
-            wp.update_status(task=task, status='In specification')
-            continue
-        elif len(docs) == 1:
-            doc = docs[0]
-        else:
-            wp.add_comment(member_id=task['id'], comment="Multiple CouchDB documents found for this member\n Please fix this first")
-            wp.update_status(task=task, status='In specification')
-            continue
-        task[CUSTOMFIELD['username']] = replace_umlauts(task[(CUSTOMFIELD['username'])])
+            changes.add_comment("No CouchDB document found for this member\n Something went wrong")
+            changes.set_status('In specification')
+            return 'rejected'
+        elif len(docs) > 1:
+            changes.add_comment("Multiple CouchDB documents found for this member\n Please fix this first")
+            changes.set_status('In specification')
+            return 'rejected'
+        doc = docs[0]
         # Create openproject user accounts from task data
         if task.get(CUSTOMFIELD['openproject']):
             if doc.get('openproject'):
@@ -86,13 +86,13 @@ def create_user_accounts():
                 user = up.create_new_user(task=task)
                 if user:
                     op_user_info = up.user_info(user)
-                    wp.add_comment(member_id=task['id'],comment=json.dumps(op_user_info))
+                    changes.add_comment(json.dumps(op_user_info))
                     doc['openproject'] = op_user_info
                     # update task status to 'in progress'
-                    wp.update_status(task, 'In progress')  # Assuming status ID 7 is 'in progress'
+                    changes.set_status('In progress')
                 else:
-                    wp.add_comment(member_id=task['id'],comment="Failed to create user in OpenProject")
-                    wp.update_status(task, 'In specification')
+                    changes.add_comment("Failed to create user in OpenProject")
+                    changes.set_status('In specification')
                     print(f"Failed to create user in OpenProject")
         # Create nextcloud account
         if task.get(CUSTOMFIELD['nextcloud']):
@@ -107,16 +107,84 @@ def create_user_accounts():
             if nextcloud_user:
                 nx_user_info = next_client.user_info(nextcloud_user)
                 doc['nextcloud'] = nx_user_info
-                wp.add_comment(member_id=task['id'], comment=json.dumps(nx_user_info))
+                changes.add_comment(json.dumps(nx_user_info))
             else:
-                wp.add_comment(member_id=task['id'], comment=f"Failed to create user {nextcloud_user_data['username']} in Nextcloud")
+                changes.add_comment(f"Failed to create user {nextcloud_user_data['username']} in Nextcloud")
                 print(f"Failed to create user {nextcloud_user_data['username']} in Nextcloud")
-        client.db.save(doc)
-    return "Create user accounts task finished"
+        writer.save(doc)
+        return 'created'
+    except Exception:
+        # the accounts or the document are incomplete, leave the task in its queue
+        changes.discard_fields()
+        raise
+    finally:
+        changes.commit()
+
+
+@dg.asset(group_name="account",
+          description="op->>opu op->>next\n Create accounts")
+def create_user_accounts():
+    # Load OpenProject tasks with status 'scheduled'
+    client = Client()
+    tasks = wp.get_workpackages(status_id=STATUS['Scheduled'], project_id=18, select=TASK_FIELDS)
+    if not tasks:
+        return "No tasks found with status 'scheduled' in OpenProject"
+    # Get couchdb entries for all tasks in one lookup
+    docs_by_member_id = client.get_docs_by_member_ids(task['id'] for task in tasks)
+    usernames = normalize_umlauts(pd.Series([task.get(CUSTOMFIELD['username']) or '' for task in tasks]))
+    for task, username in zip(tasks, usernames):
+        task[CUSTOMFIELD['username']] = username
+    # Provision tasks concurrently, a failing task does not stop the others
+    results = {'created': 0, 'rejected': 0, 'failed': 0}
+    workers = accounts_config.get('max_workers', DEFAULT_ACCOUNT_WORKERS)
+    with client.bulk_writer() as writer, ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(provision_account, task, docs_by_member_id.get(task['id']), writer): task
+                   for task in tasks}
+        for future in as_completed(futures):
+            try:
+                results[future.result()] += 1
+            except Exception as e:
+                print(f"Failed to provision accounts for task {futures[future]['id']}: {e}")
+                results['failed'] += 1
+    return f"Create user accounts task finished: {results}, {writer.summary()}"
         
          
 # CONSOLIDATION PIPELINE
 
+def apply_member_to_doc(doc: dict, member: dict) -> dict:
+    """
+    Copy the OpenProject member task fields into a CouchDB document.
+    """
+    doc['firstname'] = member[CUSTOMFIELD['firstname']]
+    doc['lastname'] = member[CUSTOMFIELD['lastname']]
+    doc['email'] = member[CUSTOMFIELD['email']]
+    doc['username'] = member[CUSTOMFIELD['username']]
+    doc['git'] = member[CUSTOMFIELD['git']]
+    doc['public_key'] = member[CUSTOMFIELD['public key']]
+    doc['telephone'] = member[CUSTOMFIELD['telephone']]
+    doc['training'] = member['_links'][CUSTOMFIELD['training']]
+    doc['altstadt'] = member[CUSTOMFIELD['altstadt']]
+    doc['neuenheim'] = member[CUSTOMFIELD['neuenheim']]
+    return doc
+
+def group_by_member_id(docs) -> tuple[dict, int]:
+    """
+    Group CouchDB documents by integer member_id.
+    Documents whose member_id is null or not a number are logged and skipped.
+    :return: dict of member_id -> documents, number of skipped documents
+    """
+    grouped = {}
+    invalid = 0
+    for doc in docs:
+        try:
+            member_id = int(doc['member_id'])
+        except (TypeError, ValueError):
+            print(f"Invalid member_id in {doc['_id']}: {doc['member_id']}")
+            invalid += 1
+            continue
+        grouped.setdefault(member_id, []).append(doc)
+    return grouped, invalid
+
 @dg.asset(name="update_couchdb",
           group_name="consolidation",
           description="op->>couch\nUpdate CouchDB with OpenProject user task data"
@@ -126,38 +194,60 @@ def update_couchdb():
     get all couch docs
     op->>couch
     Update CouchDB with OpenProject user task data
+    Once a run has completed, only member tasks updated since the last seen
+    updatedAt are fetched. Set incremental_sync = false in the workpackages
+    config to always run a full sync.
+    Fetches are strict: if a page of work packages fails, the asset fails
+    and the watermark is left unchanged.
     """
     wp = WorkPackageParser()
     client = Client()
-    #get all documents from CouchDB
-    for doc in client.get_all_docs():
-        if doc['member_id']:
-            member = wp.get_member(doc['member_id'])
-            if not member:
+    watermark = None
+    if wp.config.get('incremental_sync', True):
+        watermark = client.get_checkpoint('openproject_updated_at')
+    latest = watermark or ''
+    invalid_member_ids = 0
+    # buffer saves and write them with _bulk_docs
+    writer = client.bulk_writer()
+    if watermark:
+        # incremental: one filtered query for the tasks changed since the last run
+        changed = wp.iter_workpackages(project_id=18, updated_after=watermark,
+                                       sort_by=[('updatedAt', 'asc'), ('id', 'asc')], strict=True)
+        for members in chunked(changed, FIND_BATCH_SIZE):
+            docs_by_member_id = client.get_docs_by_member_ids(member['id'] for member in members)
+            for member in members:
+                latest = max(latest, member.get('updatedAt') or '')
+                for doc in docs_by_member_id.get(member['id'], []):
+                    writer.save(apply_member_to_doc(doc, member))
+    else:
+        # stream CouchDB documents batch by batch, memory stays flat
+        # no member_id means initialisation was not run yet
+        linked = (doc for doc in client.iter_all_docs() if doc.get('member_id'))
+        for batch in chunked(linked, FIND_BATCH_SIZE):
+            docs, invalid = group_by_member_id(batch)
+            invalid_member_ids += invalid
+            if not docs:
+                # without ids the query would return every work package
+                continue
+            # one filtered query for the member tasks of this batch
+            for member in wp.iter_workpackages(ids=list(docs), strict=True):
+                latest = max(latest, member.get('updatedAt') or '')
+                for doc in docs.pop(member['id'], []):
+                    # Save the updated document back to CouchDB
+                    writer.save(apply_member_to_doc(doc, member))
+            for member_id in docs:
                 # TODO: Handle missing member case
                 # we have a member id yet no member entry in OpenProject
                 # we should consider deleting accounts in this branch
                 # alternativly we could create a new member entry with a delete subject
-                print(f"Member with ID {doc['member_id']} not found in OpenProject")
-                continue
-            else:
-                # Update the document with OpenProject user task data
-                doc['firstname'] = member[CUSTOMFIELD['firstname']]
-                doc['lastname'] = member[CUSTOMFIELD['lastname']]
-                doc['email'] = member[CUSTOMFIELD['email']]
-                doc['username'] = member[CUSTOMFIELD['username']]
-                doc['git'] = member[CUSTOMFIELD['git']]
-                doc['public_key'] = member[CUSTOMFIELD['public key']]
-                doc['telephone'] = member[CUSTOMFIELD['telephone']]
-                doc['training'] = member['_links'][CUSTOMFIELD['training']]
-                doc['altstadt'] = member[CUSTOMFIELD['altstadt']]
-                doc['neuenheim'] = member[CUSTOMFIELD['neuenheim']]
-                # Save the updated document back to CouchDB
-                client.db.save(doc)
-        else:
-            # no member_id means initialisation was not run yet
-            continue
-    return "CouchDB updated successfully with OpenProject user task data"
+                print(f"Member with ID {member_id} not found in OpenProject")
+    writer.flush()
+    # keep the old watermark if documents failed to save, the next run retries them
+    if latest and latest != watermark and not writer.conflicts:
+        client.set_checkpoint('openproject_updated_at', latest)
+    summary = {**writer.summary(), 'invalid_member_id': invalid_member_ids}
+    print(f"update_couchdb: {summary}")
+    return f"CouchDB updated successfully with OpenProject user task data: {summary}"
 
 @dg.asset(name="validate_user_openproject", 
           group_name="consolidation",
@@ -168,24 +258,32 @@ def user_openproject_data():
     # Fetch user data from OpenProject
     up = UserParser()
     client = Client()
-    res = up.get_users()
-    for user in res['users']:
-        # Create or update user in CouchDB
-        openproject_data = up.user_info(user)
-        # get couchdb document
-        docs = client.get_doc_by_openproject_id(openproject_id=user['id']) or \
-            client.get_doc_by_email(email=user['email'])
-        if docs and len(docs) == 1:
-            doc = docs[0]
-            # Update existing document
-            doc['openproject'] = openproject_data
-        else:
-            # TODO: handle this case
-            # We have no document yet
-            # we leave this for now until the delete workflow is specified
-            continue
-        # Save to CouchDB
-        client.db.save(doc)
+    res = {'count': 0, 'updated': 0}
+    writer = client.bulk_writer()
+    # stream users from OpenProject, later pages load while we process
+    for users in chunked(up.iter_users(), FIND_BATCH_SIZE):
+        # get couchdb documents, by openproject_id first, then by email
+        by_id = client.get_docs_by_openproject_ids(user['id'] for user in users)
+        by_email = client.get_docs_by_emails(user['email'] for user in users if not by_id.get(user['id']))
+        for user in users:
+            res['count'] += 1
+            # Create or update user in CouchDB
+            openproject_data = up.user_info(user)
+            docs = by_id.get(user['id']) or by_email.get(user['email'])
+            if docs and len(docs) == 1:
+                doc = docs[0]
+                # Update existing document
+                doc['openproject'] = openproject_data
+            else:
+                # TODO: handle this case
+                # We have no document yet
+                # we leave this for now until the delete workflow is specified
+                continue
+            # Save to CouchDB
+            writer.save(doc)
+            res['updated'] += 1
+    writer.flush()
+    res.update(writer.summary())
     return res
 
 @dg.asset(name="validate_user_nextcloud",
@@ -199,23 +297,23 @@ def user_nextcloud_data():
     next->>couch
     """
     client = Client()
-    # Fetch user data from Nextcloud
-    users = next_client.get_users()
-    for user in users:
+    writer = client.bulk_writer()
+    # Fetch user details from Nextcloud, concurrently and only once
+    users = next_client.get_user_infos()
+    next_client.directory.set_users([next_client.user_dict(user) for user in users])
+    # get couchdb documents, by nextcloud_id first, then by email
+    by_id = client.get_docs_by_nextcloud_ids(user.user_id for user in users)
+    by_email = client.get_docs_by_emails(user.email for user in users if not by_id.get(user.user_id))
+    res = {'count': len(users)}
+    for userinfo in users:
         # Create or update user in CouchDB
-        userinfo = next_client.get_user(user_id=user['id'])
-        if not userinfo:
-            continue
         nextcloud_data = next_client.user_info(userinfo)
-        # get couchdb document
-        
-        res = client.get_doc_by_nextcloud_id(nextcloud_id=nextcloud_data['nextcloud_id']) or \
-            client.get_doc_by_email(email=nextcloud_data['nextcloud_email'])
-        if res and len(res) == 1:
+        docs = by_id.get(nextcloud_data['nextcloud_id']) or by_email.get(nextcloud_data['nextcloud_email'])
+        if docs and len(docs) == 1:
             # Update existing document
-            doc = res[0]    
+            doc = docs[0]
             doc['nextcloud'] = nextcloud_data
-        elif res and len(res) > 1:
+        elif docs and len(docs) > 1:
             # TODO: handle and log this case
             continue
         else:
@@ -225,7 +323,10 @@ def user_nextcloud_data():
             continue
         
         # Save to CouchDB
-        client.db.save(doc)
+        writer.save(doc)
+    writer.flush()
+    res.update(writer.summary())
+    print(f"validate_user_nextcloud: {res}")
     return res
 
 
@@ -241,23 +342,66 @@ def update_openproject_member_tasks():
     """
     client = Client()
     # Fetch all member tasks in Status In progress
-    tasks = wp.get_workpackages(status_id=STATUS['In progress'], project_id=18)
+    tasks = wp.get_workpackages(status_id=STATUS['In progress'], project_id=18, select=TASK_FIELDS)
+    docs_by_member_id = client.get_docs_by_member_ids(member['id'] for member in tasks)
     for member in tasks:
-        docs = client.get_doc_by_member_id(member_id=member['id'])   
+        docs = docs_by_member_id.get(member['id'])
         if not docs:
-            wp.add_comment(member_id=member['id'], comment="No CouchDB document found for this member")
-            wp.update_status(task=member, status='In specification')            
-            continue
+            changes = wp.changes(member)
+            changes.add_comment("No CouchDB document found for this member")
+            changes.set_status('In specification')
+            changes.commit()
         elif len(docs) == 1:
+            # also sets the status to In progress
             wp.update_member_task(doc=docs[0], member=member)
-            wp.update_status(task=member, status='In progress')
         else:
-            wp.add_comment(member_id=member['id'], comment="Multiple CouchDB documents found for this member")
-            wp.update_status(task=member, status='In specification')
+            changes = wp.changes(member)
+            changes.add_comment("Multiple CouchDB documents found for this member")
+            changes.set_status('In specification')
+            changes.commit()
     # Return a success message
-    return "OpenProject member tasks created successfully"
+    return f"OpenProject member tasks created successfully: {wp.conflict_metrics()}"
   
-                
+
+@dg.asset(name="propagate_couchdb_changes",
+          group_name="consolidation",
+          description="couch->>op\nPush CouchDB member docs changed since the last run to OpenProject")
+def propagate_couchdb_changes():
+    """
+    couch changes->>op
+    Update the member tasks in Status In progress for the documents changed since the
+    last run, read from the CouchDB _changes feed instead of scanning all documents.
+    The checkpoint only advances if every update succeeded, otherwise the next run
+    reads the same changes again. A failed page of member tasks fails the asset.
+    """
+    client = Client()
+    res = {'changed': 0, 'updated': 0, 'failed': 0, 'invalid_member_id': 0}
+    changed = client.iter_changes(selector={"member_id": {"$exists": True}})
+    for docs in chunked(changed, FIND_BATCH_SIZE):
+        res['changed'] += len(docs)
+        # a document changed again while reading the feed shows up twice, keep the latest
+        docs_by_member_id, invalid = group_by_member_id({doc['_id']: doc for doc in docs}.values())
+        res['invalid_member_id'] += invalid
+        if not docs_by_member_id:
+            # without ids the query would return every task in progress
+            continue
+        for member in wp.iter_workpackages(ids=list(docs_by_member_id),
+                                           status_id=STATUS['In progress'],
+                                           select=TASK_FIELDS,
+                                           strict=True):
+            member_docs = docs_by_member_id[member['id']]
+            if len(member_docs) == 1:
+                result = wp.update_member_task(doc=member_docs[0], member=member)
+                if result is None or 'error' in result:
+                    res['failed'] += 1
+                else:
+                    res['updated'] += 1
+            else:
+                wp.add_comment(member_id=member['id'], comment="Multiple CouchDB documents found for this member")
+    if not res['failed']:
+        client.set_checkpoint('changes_since', client.changes_seq)
+    return res
+
 def fix_doc_id(doc: dict) -> dict:
     """
     Fix the document ID to ensure it is in the correct format.
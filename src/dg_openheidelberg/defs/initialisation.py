@@ -1,6 +1,7 @@
 import dagster as dg
 from nextcloud import NextcloudClient
 import pandas as pd
+from onboarding import validate_onboarding, ONBOARDING_DTYPES
 
 user_onboarding = "src/dg_openheidelberg/defs/data/user_onboarding.csv"
 next_client = NextcloudClient()
@@ -8,52 +9,48 @@ next_client = NextcloudClient()
 # INITIALISATION PIPELINE
 @dg.asset(name="user_onboarding_csv",
           group_name="initialisation",
+          io_manager_key="parquet_io_manager",
+          metadata={"dtypes": ONBOARDING_DTYPES},
           description="GET user onboarding csv data from Nextcloud")
 def user_onboarding_csv_data():
     """Load user onboarding data from Nextcloud"""
-    # Download the file from Nextcloud to the local path
-    next_client.download_file('user_onboarding.csv', user_onboarding)
+    # Download the file from Nextcloud only if the remote etag changed
+    version = next_client.download_file_if_changed('user_onboarding.csv', user_onboarding)
     # Load and return the data
-    df = pd.read_csv(user_onboarding)
-    return df
+    df = pd.read_csv(user_onboarding, dtype=ONBOARDING_DTYPES)
+    # data_version lets downstream assets skip work if the file did not change
+    return dg.Output(df,
+                     data_version=dg.DataVersion(version['etag']),
+                     metadata={"fresh": dg.MetadataValue.bool(version['changed']),
+                               "etag": dg.MetadataValue.text(version['etag']),
+                               "last_modified": dg.MetadataValue.text(version['last_modified']),
+                               "rows": dg.MetadataValue.int(len(df))})
 
 @dg.asset_check(asset="user_onboarding_csv")
-def check_user_onboarding_has_email_data():
-    """Check that user_onboarding contains email column with valid email addresses."""
-    try:
-        df = pd.read_csv(user_onboarding)
-        # Check if email column exists
-        if 'email' not in df.columns:
-            return dg.AssetCheckResult(
-                passed=False,
-                description="Email column is missing from the onboarding data file"
-            )
-        
-        # Check if email column has data (non-empty values)
-        email_count = df['email'].notna().sum()
-        total_rows = len(df)
-        
-        if email_count == 0:
-            return dg.AssetCheckResult(
-                passed=False,
-                description="Email column exists but contains no data"
-            )
-        
-        # Check for valid email format (basic validation)
-        valid_emails = df['email'].str.contains('@', na=False).sum()
-        
+def check_user_onboarding_has_email_data(user_onboarding_csv: pd.DataFrame):
+    """Validate the loaded onboarding data: email format, duplicates, missing names and umlauts."""
+    df = user_onboarding_csv
+    # Check if email column exists
+    if 'email' not in df.columns:
         return dg.AssetCheckResult(
-            passed=True,
-            description=f"Email data validated: {valid_emails} valid emails out of {total_rows} total rows, {valid_emails} with valid format",
-            metadata={
-                "total_rows": dg.MetadataValue.int(int(total_rows)),
-                "emails_with_data": dg.MetadataValue.int(int(email_count)),
-                "valid_email_format": dg.MetadataValue.int(int(valid_emails))
-            }
+            passed=False,
+            description="Email column is missing from the onboarding data file"
         )
-        
-    except Exception as e:
+    results = validate_onboarding(df)
+    metadata = {rule: dg.MetadataValue.int(count) for rule, count in results.items()}
+    if results['emails_with_data'] == 0:
         return dg.AssetCheckResult(
             passed=False,
-            description=f"Failed to read or validate sample data file: {str(e)}"
-        )
\ No newline at end of file
+            description="Email column exists but contains no data",
+            metadata=metadata
+        )
+    problems = {rule: count for rule, count in results.items()
+                if count and rule in ('invalid_email_format', 'duplicate_emails', 'duplicate_usernames',
+                                      'missing_firstname', 'missing_lastname')}
+    return dg.AssetCheckResult(
+        passed=not problems,
+        severity=dg.AssetCheckSeverity.WARN,
+        description=f"Onboarding data validated: {results['total_rows']} rows"
+                    + (f", problems: {problems}" if problems else ""),
+        metadata=metadata
+    )
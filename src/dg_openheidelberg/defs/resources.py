@@ -0,0 +1,45 @@
+import os
+import dagster as dg
+import pandas as pd
+
+PARQUET_DIR = "src/dg_openheidelberg/defs/data/parquet"
+
+
+def metadata_value(metadata, key: str):
+    """Raw value of a definition metadata entry, None if not set."""
+    value = (metadata or {}).get(key)
+    return getattr(value, 'value', value)
+
+
+class ParquetIOManager(dg.ConfigurableIOManager):
+    """
+    Store pandas DataFrames as Parquet files, one file per asset.
+    Asset metadata "dtypes" (column -> dtype) casts columns before writing,
+    input metadata "columns" loads only the listed columns.
+    """
+    base_dir: str = PARQUET_DIR
+    compression: str = "zstd"
+
+    def path(self, context: dg.OutputContext) -> str:
+        return os.path.join(self.base_dir, *context.asset_key.path) + ".parquet"
+
+    def handle_output(self, context: dg.OutputContext, obj: pd.DataFrame) -> None:
+        dtypes = metadata_value(context.definition_metadata, 'dtypes') or {}
+        obj = obj.astype({column: dtype for column, dtype in dtypes.items() if column in obj.columns})
+        path = self.path(context)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        obj.to_parquet(tmp_path, compression=self.compression, index=False)
+        os.replace(tmp_path, path)
+        context.add_output_metadata({
+            "path": dg.MetadataValue.path(path),
+            "rows": dg.MetadataValue.int(len(obj)),
+            "bytes": dg.MetadataValue.int(os.path.getsize(path)),
+        })
+
+    def load_input(self, context: dg.InputContext) -> pd.DataFrame:
+        columns = metadata_value(context.definition_metadata, 'columns')
+        return pd.read_parquet(self.path(context.upstream_output), columns=columns)
+
+
+defs = dg.Definitions(resources={"parquet_io_manager": ParquetIOManager()})
@@ -1,8 +1,109 @@
+import asyncio
+import hashlib
 import json
-from typing import Optional, List, Dict, Any
-from nc_py_api import Nextcloud
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Any, Iterable, Callable
+from urllib.parse import quote, unquote
+from xml.etree import ElementTree
+from nc_py_api import Nextcloud, AsyncNextcloud
+from nc_py_api._exceptions import check_error
 from nc_py_api.users import UserInfo
 from config import Config
+from transport import RequestExecutor
+
+DEFAULT_USER_WORKERS = 8
+DEFAULT_CONCURRENCY = 8
+DEFAULT_USER_CACHE_TTL = 300
+DEFAULT_UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024
+DEFAULT_UPLOAD_RETRIES = 3
+
+
+class UserDirectory:
+    """
+    Cached Nextcloud user directory with O(1) lookups by id, email and display name.
+    The whole directory is reloaded once it is older than ttl seconds,
+    single users can be added or invalidated in between.
+    """
+
+    def __init__(self, loader: Optional[Callable[[], List[Dict[str, Any]]]] = None,
+                 ttl: float = DEFAULT_USER_CACHE_TTL) -> None:
+        """
+        Args:
+            loader: returns all users as dicts with id, email and displayname,
+                None if the owner reloads with set_users itself (async clients)
+            ttl: seconds until the directory is reloaded
+        """
+        self.loader = loader
+        self.ttl = ttl
+        self.loaded_at: Optional[float] = None
+        self.users: Dict[str, Dict[str, Any]] = {}
+        self.positions: Dict[str, int] = {}
+        self.next_position = 0
+        self.by_email: Dict[str, List[str]] = {}
+        self.by_displayname: Dict[str, List[str]] = {}
+        self.lock = threading.RLock()
+
+    @property
+    def expired(self) -> bool:
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > self.ttl
+
+    def set_users(self, users: List[Dict[str, Any]]) -> None:
+        """Replace the directory content, e.g. with a freshly fetched user list."""
+        with self.lock:
+            self.users = {}
+            self.positions = {}
+            self.next_position = 0
+            self.by_email = {}
+            self.by_displayname = {}
+            for user in users:
+                self.add(user)
+            self.loaded_at = time.monotonic()
+
+    def refresh(self) -> None:
+        self.set_users(self.loader())
+
+    def add(self, user: Dict[str, Any]) -> None:
+        """Add or replace a single user."""
+        with self.lock:
+            self.invalidate(user['id'])
+            self.users[user['id']] = user
+            self.positions[user['id']] = self.next_position
+            self.next_position += 1
+            if user.get('email'):
+                self.by_email.setdefault(user['email'], []).append(user['id'])
+            if user.get('displayname'):
+                self.by_displayname.setdefault(user['displayname'], []).append(user['id'])
+
+    def invalidate(self, user_id: str) -> None:
+        """Drop a single user from the directory."""
+        with self.lock:
+            user = self.users.pop(user_id, None)
+            self.positions.pop(user_id, None)
+            if user is None:
+                return
+            for index, key in ((self.by_email, user.get('email')), (self.by_displayname, user.get('displayname'))):
+                if key in index:
+                    index[key].remove(user_id)
+                    if not index[key]:
+                        del index[key]
+
+    def find(self, email: str, username: str, displayname: str) -> Dict[str, Any]|None:
+        """
+        Find a user by username, email or display name.
+        Like a scan of the user list, the user listed first wins if several match.
+        """
+        with self.lock:
+            if self.expired:
+                self.refresh()
+            candidates = [username] + self.by_email.get(email, [])[:1] + self.by_displayname.get(displayname, [])[:1]
+            matches = [user_id for user_id in candidates if user_id in self.positions]
+            if not matches:
+                return None
+            return self.users[min(matches, key=self.positions.__getitem__)]
 
 class NextcloudClient:
     """
@@ -12,43 +113,143 @@ class NextcloudClient:
     def __init__(self, config: Optional[Dict[str, Any]] = None) -> None:
         self.config = config or Config().get('nextcloud')
         self.nc = Nextcloud(nextcloud_url=self.config['url'], nc_auth_user=self.config['username'], nc_auth_pass=self.config['password'])
-        self.users = []
+        self.directory = UserDirectory(self.get_users, ttl=self.config.get('user_cache_ttl', DEFAULT_USER_CACHE_TTL))
+        self.executor = RequestExecutor.for_config(self.config)
 
+    def call(self, func: Callable, *args, idempotent: bool = True, **kwargs) -> Any:
+        """Call a nc_py_api function rate limited and retried by the shared executor."""
+        return self.executor.execute(lambda: func(*args, **kwargs), idempotent=idempotent)
 
     def show_capabilities(self):
-        pretty_capabilities = json.dumps(self.nc.capabilities, indent=4, sort_keys=True)
+        pretty_capabilities = json.dumps(self.call(lambda: self.nc.capabilities), indent=4, sort_keys=True)
         print(pretty_capabilities)
 
+    def get_user_infos(self, user_ids: Optional[Iterable[str]] = None) -> List[UserInfo]:
+        """Fetch full user details concurrently.
+
+        Args:
+            user_ids: users to fetch, all users if None
+        Returns:
+            UserInfo objects in the order of user_ids, users that failed to load are left out
+        """
+        if user_ids is None:
+            user_ids = self.get_user_ids()
+        workers = self.config.get('user_workers', DEFAULT_USER_WORKERS)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            users = list(pool.map(self.get_user, user_ids))
+        return [user for user in users if user]
+
+    def user_dict(self, user: UserInfo) -> Dict[str, Any]:
+        """Short user summary as returned by get_users."""
+        return {
+            'id': user.user_id,
+            'email': user.email,
+            'displayname': user.display_name,
+            'enabled': user.enabled,
+            'last_login': user.last_login.strftime('%Y-%m-%d')
+        }
+
+    def get_user_ids(self) -> List[str]:
+        """All user ids (logins) with a single request, without fetching user details."""
+        return self.call(self.nc.users.get_list)
+
     def get_users(self):
-        user_ids = self.nc.users.get_list()
-        all_users = []
-        for user_id in user_ids:
-            user = self.nc.users.get_user(user_id)
-            user_dict = {
-                'id': user.user_id,
-                'email': user.email,
-                'displayname': user.display_name,
-                'enabled': user.enabled,
-                'last_login': user.last_login.strftime('%Y-%m-%d')
-            }
-            all_users.append(user_dict)
-        return all_users
+        return [self.user_dict(user) for user in self.get_user_infos()]
 
     def check_user(self,
                    email: str,
                    username: str,
                    firstname: str,
                    lastname: str) -> Dict[str, Any]|None:
-        if not self.users:
-            self.users = self.get_users()
-        for user in self.users:
-            if username == user['id'] or email == user['email'] or f"{firstname} {lastname}" == user['displayname']:
-                return user
-        return None
+        return self.directory.find(email=email, username=username, displayname=f"{firstname} {lastname}")
+
+
+    def upload_file(self, remote_path, file_path, chunk_size: int | None = None) -> Dict[str, Any]:
+        """Upload a local file to Nextcloud in chunks.
+
+        Chunks are stored in a DAV upload folder named after the target path, size and mtime
+        of the local file, so calling upload_file again after a failure only sends the chunks
+        missing on the server. Each chunk carries its SHA1 in OC-Checksum and is retried up to
+        upload_retries times. The whole-file SHA1 is sent with the final MOVE; afterwards size
+        and SHA1 of the assembled file are read back (oc:checksums) and compared with the local file.
+
+        Args:
+            remote_path: Path to file on Nextcloud
+            file_path: Local file to upload
+            chunk_size: Bytes per chunk, defaults to config upload_chunk_size (5 MiB)
+
+        Returns:
+            Dict with bytes, bytes_sent, chunks, chunks_skipped, retries, seconds and bytes_per_second
+        """
+        chunk_size = chunk_size or self.config.get('upload_chunk_size', DEFAULT_UPLOAD_CHUNK_SIZE)
+        retries = self.config.get('upload_retries', DEFAULT_UPLOAD_RETRIES)
+        session = self.nc._session
+        dav = session.adapter_dav
+        stat = os.stat(file_path)
+        upload_id = hashlib.sha1(f"{remote_path}:{stat.st_size}:{stat.st_mtime_ns}:{chunk_size}".encode()).hexdigest()
+        upload_path = quote(f"/uploads/{session.user}/dg-openheidelberg-{upload_id}")
+        file_path_dav = quote(f"/files/{session.user}/{remote_path.lstrip('/')}")
+        destination = session.cfg.dav_endpoint + file_path_dav
 
+        existing = self.uploaded_chunks(upload_path)
+        if existing is None:
+            check_error(self.call(dav.request, "MKCOL", upload_path))
+            existing = set()
+        metrics = {'bytes': 0, 'bytes_sent': 0, 'chunks': 0, 'chunks_skipped': 0, 'retries': 0}
+        file_hash = hashlib.sha1()
+        start = time.monotonic()
+        with open(file_path, 'rb') as f:
+            while piece := f.read(chunk_size):
+                file_hash.update(piece)
+                name = f"{metrics['bytes']:015d}-{metrics['bytes'] + len(piece):015d}"
+                metrics['bytes'] += len(piece)
+                metrics['chunks'] += 1
+                if name in existing:
+                    metrics['chunks_skipped'] += 1
+                    continue
+                headers = {'OC-Checksum': f"SHA1:{hashlib.sha1(piece).hexdigest()}"}
+                check_error(self.executor.execute(lambda: dav.put(f"{upload_path}/{name}", data=piece, headers=headers),
+                                                  max_retries=retries, stats=metrics))
+                metrics['bytes_sent'] += len(piece)
 
-    def upload_file(self, remote_path, file_path):
-        self.nc.files.upload_stream(path=remote_path, fp=file_path,)
+        check_error(self.call(dav.request, "MOVE", f"{upload_path}/.file", idempotent=False,
+                              headers={'Destination': destination,
+                                       'OC-Checksum': f"SHA1:{file_hash.hexdigest()}"}))
+        size, checksums = self.stored_checksums(file_path_dav)
+        if size != metrics['bytes']:
+            raise IOError(f"Upload of {remote_path} incomplete: expected {metrics['bytes']} bytes, found {size}")
+        if checksums.get('SHA1') != file_hash.hexdigest():
+            raise IOError(f"Upload of {remote_path} corrupted: expected SHA1 {file_hash.hexdigest()}, "
+                          f"found {checksums.get('SHA1', 'no checksum')}")
+        metrics['seconds'] = round(time.monotonic() - start, 3)
+        metrics['bytes_per_second'] = int(metrics['bytes_sent'] / metrics['seconds']) if metrics['seconds'] else 0
+        return metrics
+
+    def uploaded_chunks(self, upload_path: str) -> set[str] | None:
+        """Names of the chunks already stored in a DAV upload folder, None if the folder does not exist."""
+        response = self.call(self.nc._session.adapter_dav.request, "PROPFIND", upload_path, headers={'Depth': '1'},
+                             data='<?xml version="1.0"?><d:propfind xmlns:d="DAV:"><d:prop><d:resourcetype/></d:prop></d:propfind>')
+        if response.status_code == 404:
+            return None
+        check_error(response)
+        hrefs = [unquote(href.text.rstrip('/')) for href in ElementTree.fromstring(response.content).iter('{DAV:}href')]
+        return {href.rsplit('/', 1)[-1] for href in hrefs if not href.endswith(unquote(upload_path))}
+
+    def stored_checksums(self, dav_path: str) -> tuple[int | None, Dict[str, str]]:
+        """Size and checksums (algorithm -> lower case hex digest) Nextcloud stores for a file."""
+        response = self.call(self.nc._session.adapter_dav.request, "PROPFIND", dav_path, headers={'Depth': '0'},
+                             data='<?xml version="1.0"?><d:propfind xmlns:d="DAV:" xmlns:oc="http://owncloud.org/ns">'
+                                  '<d:prop><d:getcontentlength/><oc:checksums/></d:prop></d:propfind>')
+        check_error(response)
+        root = ElementTree.fromstring(response.content)
+        length = root.find('.//{DAV:}getcontentlength')
+        checksums = {}
+        # one oc:checksum element with space separated entries, e.g. "SHA1:ab12 MD5:cd34"
+        for checksum in root.iter('{http://owncloud.org/ns}checksum'):
+            for entry in (checksum.text or '').split():
+                algorithm, _, digest = entry.partition(':')
+                checksums[algorithm.upper()] = digest.lower()
+        return (int(length.text) if length is not None and length.text else None), checksums
 
     def download_file(self, remote_file, local_path):
         """Download a file from Nextcloud to local path.
@@ -58,22 +259,77 @@ class NextcloudClient:
             local_path: Local path where file will be saved
         """
         with open(local_path, 'wb') as f:
-            self.nc.files.download2stream(remote_file, f)
+            self.call(self.download2stream, remote_file, f)
+
+    def download2stream(self, remote_file, f) -> None:
+        """Download into a file object, starting over if an earlier attempt wrote into it."""
+        f.seek(0)
+        f.truncate()
+        self.nc.files.download2stream(remote_file, f)
+
+    def remote_version(self, remote_file) -> Dict[str, Any] | None:
+        """Return etag and last_modified of a remote file using a single PROPFIND, None if it does not exist."""
+        node = self.call(self.nc.files.by_path, remote_file)
+        if node is None:
+            return None
+        return {'etag': node.etag, 'last_modified': node.info.last_modified.isoformat()}
+
+    def download_file_if_changed(self, remote_file, local_path) -> Dict[str, Any]:
+        """Download a file only if the remote version differs from the local copy.
+
+        The remote etag is kept in a sidecar file next to the local copy. The download is
+        streamed to a temporary file in the same directory and renamed into place, so
+        readers never see a partially written file.
+
+        Args:
+            remote_file: Path to file on Nextcloud
+            local_path: Local path where file will be saved
+
+        Returns:
+            Dict with etag, last_modified and changed (False if the transfer was skipped)
+        """
+        version_path = f"{local_path}.version.json"
+        remote = self.remote_version(remote_file)
+        if remote is None:
+            raise FileNotFoundError(f"{remote_file} not found on Nextcloud")
+        if os.path.exists(local_path) and os.path.exists(version_path):
+            with open(version_path) as f:
+                local = json.load(f)
+            if local.get('etag') == remote['etag']:
+                return {**remote, 'changed': False}
+        directory = os.path.dirname(os.path.abspath(local_path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.download-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                self.call(self.download2stream, remote_file, f)
+            os.replace(tmp_path, local_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        with open(version_path, 'w') as f:
+            json.dump(remote, f)
+        return {**remote, 'changed': True}
 
     def create_user(self, userdata) -> UserInfo | None:
         """Create a new user in Nextcloud."""
         try:
-            self.nc.users.create(user_id=userdata['username'], email=userdata['email'], display_name=f"{userdata['firstname']} {userdata['lastname']}")
+            self.call(self.nc.users.create, idempotent=False, user_id=userdata['username'], email=userdata['email'],
+                      display_name=f"{userdata['firstname']} {userdata['lastname']}")
             user = self.get_user(userdata['username'])
-            return user
         except Exception as e:
             print(f"Error creating user: {e}")
             return None
+        if user:
+            self.directory.add(self.user_dict(user))
+        else:
+            self.directory.invalidate(userdata['username'])
+        return user
 
     def get_user(self, user_id: str) -> UserInfo | None:
         """Get a user from Nextcloud by user ID."""
         try:
-            user = self.nc.users.get_user(user_id)
+            user = self.call(self.nc.users.get_user, user_id)
             return user
         except Exception as e:
             print(f"Error getting user: {e}")
@@ -96,4 +352,89 @@ class NextcloudClient:
             'nextcloud_quota': user.quota,
             'nextcloud_groups': user.groups,
             'nextcloud_last_login': user.last_login.strftime("%d.%m.%Y")
-        }
\ No newline at end of file
+        }
+
+
+class AsyncNextcloudClient:
+    """
+    Async Nextcloud client built on AsyncNextcloud.
+    Network waits of many calls overlap, at most `concurrency` (nextcloud config)
+    requests are in flight at the same time.
+    Returns the same dict shapes as NextcloudClient.
+    """
+    user_info = NextcloudClient.user_info
+    user_dict = NextcloudClient.user_dict
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None) -> None:
+        self.config = config or Config().get('nextcloud')
+        self.nc = AsyncNextcloud(nextcloud_url=self.config['url'], nc_auth_user=self.config['username'], nc_auth_pass=self.config['password'])
+        self.semaphore = asyncio.Semaphore(self.config.get('concurrency', DEFAULT_CONCURRENCY))
+        self.executor = RequestExecutor.for_config(self.config)
+        # the loader is a coroutine here, check_user reloads the directory itself
+        self.directory = UserDirectory(ttl=self.config.get('user_cache_ttl', DEFAULT_USER_CACHE_TTL))
+        self.directory_lock = asyncio.Lock()
+
+    async def call(self, func: Callable, *args, idempotent: bool = True, **kwargs) -> Any:
+        """Await a nc_py_api coroutine function rate limited and retried by the shared executor."""
+        async with self.semaphore:
+            return await self.executor.execute_async(lambda: func(*args, **kwargs), idempotent=idempotent)
+
+    async def get_user(self, user_id: str) -> UserInfo | None:
+        """Get a user from Nextcloud by user ID."""
+        try:
+            return await self.call(self.nc.users.get_user, user_id)
+        except Exception as e:
+            print(f"Error getting user: {e}")
+            return None
+
+    async def get_user_infos(self, user_ids: Optional[Iterable[str]] = None) -> List[UserInfo]:
+        """Fetch full user details concurrently, all users if user_ids is None."""
+        if user_ids is None:
+            user_ids = await self.call(self.nc.users.get_list)
+        users = await asyncio.gather(*(self.get_user(user_id) for user_id in user_ids))
+        return [user for user in users if user]
+
+    async def get_users(self) -> List[Dict[str, Any]]:
+        return [self.user_dict(user) for user in await self.get_user_infos()]
+
+    async def check_user(self,
+                         email: str,
+                         username: str,
+                         firstname: str,
+                         lastname: str) -> Dict[str, Any]|None:
+        """Same lookup as NextcloudClient.check_user, concurrent calls share one reload."""
+        async with self.directory_lock:
+            if self.directory.expired:
+                self.directory.set_users(await self.get_users())
+        return self.directory.find(email=email, username=username, displayname=f"{firstname} {lastname}")
+
+    async def create_user(self, userdata) -> UserInfo | None:
+        """Create a new user in Nextcloud."""
+        try:
+            await self.call(self.nc.users.create, idempotent=False, user_id=userdata['username'], email=userdata['email'],
+                            display_name=f"{userdata['firstname']} {userdata['lastname']}")
+        except Exception as e:
+            print(f"Error creating user: {e}")
+            return None
+        user = await self.get_user(userdata['username'])
+        if user:
+            self.directory.add(self.user_dict(user))
+        else:
+            self.directory.invalidate(userdata['username'])
+        return user
+
+    async def create_users(self, users: Iterable[Dict[str, Any]]) -> List[UserInfo | None]:
+        """Create several users concurrently, results in input order."""
+        return list(await asyncio.gather(*(self.create_user(userdata) for userdata in users)))
+
+    async def upload_file(self, remote_path, file_path):
+        await self.call(self.nc.files.upload_stream, idempotent=False, path=remote_path, fp=file_path)
+
+    async def download_file(self, remote_file, local_path):
+        """Download a file from Nextcloud to local path."""
+        with open(local_path, 'wb') as f:
+            async def download():
+                f.seek(0)
+                f.truncate()
+                await self.nc.files.download2stream(remote_file, f)
+            await self.call(download)
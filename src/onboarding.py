@@ -0,0 +1,101 @@
+import pandas as pd
+from typing import Dict, Iterable
+
+EMAIL_PATTERN = r"^[^@\s]+@[^@\s]+\.[^@\s]+$"
+UMLAUT_MAP = {
+    ord('ä'): 'ae', ord('ü'): 'ue', ord('ö'): 'oe', ord('ß'): 'ss',
+    ord('Ä'): 'Ae', ord('Ü'): 'Ue', ord('Ö'): 'Oe'
+}
+UMLAUT_PATTERN = "[" + "".join(chr(char) for char in UMLAUT_MAP) + "]"
+ONBOARDING_DTYPES = {
+    'email': 'string',
+    'username': 'string',
+    'firstname': 'string',
+    'lastname': 'string',
+}
+
+
+def normalize_umlauts(values: pd.Series) -> pd.Series:
+    """Replace German umlauts in a whole column, ä -> ae, ß -> ss ..."""
+    return values.astype("string").str.translate(UMLAUT_MAP)
+
+
+def blank(values: pd.Series) -> pd.Series:
+    """True for missing or whitespace-only values."""
+    return values.astype("string").str.strip().fillna("").eq("")
+
+
+def validate_onboarding(df: pd.DataFrame) -> Dict[str, int]:
+    """
+    Validate onboarding data column-wise, without looping over rows.
+    Args:
+        df: onboarding data with email and optionally username, firstname, lastname columns
+    Returns:
+        dict of rule name to number of offending rows, plus total_rows
+    """
+    results = {'total_rows': len(df)}
+    if 'email' in df.columns:
+        email = df['email'].astype("string").str.strip().str.lower()
+        has_email = ~blank(email)
+        results['emails_with_data'] = int(has_email.sum())
+        results['invalid_email_format'] = int((has_email & ~email.str.match(EMAIL_PATTERN, na=False)).sum())
+        results['duplicate_emails'] = int(email[has_email].duplicated().sum())
+    if 'username' in df.columns:
+        username = df['username'].astype("string").str.strip().str.lower()
+        has_username = ~blank(username)
+        results['duplicate_usernames'] = int(normalize_umlauts(username[has_username]).duplicated().sum())
+        results['usernames_with_umlauts'] = int(username.str.contains(UMLAUT_PATTERN, na=False).sum())
+    for column in ('firstname', 'lastname'):
+        if column in df.columns:
+            results[f'missing_{column}'] = int(blank(df[column]).sum())
+    names = [df[column].astype("string") for column in ('firstname', 'lastname') if column in df.columns]
+    if names:
+        results['names_with_umlauts'] = int(
+            pd.concat([name.str.contains(UMLAUT_PATTERN, na=False) for name in names], axis=1).any(axis=1).sum())
+    return results
+
+
+def base_usernames(df: pd.DataFrame) -> pd.Series:
+    """First letter of firstname plus lastname, lower case, umlauts replaced, without whitespace."""
+    firstname = df['firstname'].astype("string").fillna("").str.strip()
+    lastname = df['lastname'].astype("string").fillna("")
+    return normalize_umlauts(firstname.str[:1] + lastname).str.lower().str.replace(r"\s+", "", regex=True)
+
+
+def generate_usernames(df: pd.DataFrame, taken: Iterable[str] = ()) -> pd.DataFrame:
+    """
+    Compute usernames for all rows at once.
+    Given usernames are kept (normalized), missing ones are generated from the names.
+    Generated usernames that clash with each other, a given username or a taken login
+    get a numeric suffix above the highest one in use: mmuster, mmuster2, mmuster3 ...
+    Rows without username and without first and last name get no username (NA).
+    Args:
+        df: rows with firstname, lastname and optionally username columns
+        taken: existing logins, e.g. from OpenProject and Nextcloud
+    Returns:
+        DataFrame with the index of df and columns username, generated and clash
+        (clash: a given username that is already taken)
+    """
+    if df.empty:
+        return pd.DataFrame(columns=['username', 'generated', 'clash'], index=df.index)
+    given = df['username'] if 'username' in df.columns else pd.Series(pd.NA, index=df.index)
+    given = normalize_umlauts(given).str.lower().str.replace(r"\s+", "", regex=True)
+    generated = blank(given)
+    taken = pd.Series(list(taken), dtype="string").str.lower()
+    occupied = pd.concat([taken, given[~generated]], ignore_index=True).drop_duplicates()
+    # highest suffix in use per stem, "mmuster" counts as 1, "mmuster2" as 2
+    parts = occupied.str.extract(r"^(?P<stem>.*?)(?P<number>\d*)$")
+    parts['number'] = pd.to_numeric(parts['number'], errors='coerce').fillna(1).astype(int)
+    in_use = parts.groupby('stem')['number'].max()
+
+    base = base_usernames(df[generated]).rename('stem').to_frame()
+    base['offset'] = base.groupby('stem').cumcount()
+    base = base.join(in_use.rename('in_use'), on='stem')
+    number = base['in_use'].fillna(0).astype(int) + base['offset'] + 1
+    suffix = number.astype("string").where(number > 1, "")
+
+    result = pd.DataFrame({'username': given, 'generated': generated,
+                           'clash': ~generated & given.isin(taken)}, index=df.index)
+    # no name, nothing to build a username from
+    result.loc[generated, 'username'] = (base['stem'] + suffix).where(base['stem'] != "", pd.NA)
+    return result
@@ -1,7 +1,15 @@
 import requests
+import itertools
 import json
-from typing import Optional, List, Dict, Any
+import math
+import threading
+import time
+from bisect import insort
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Any, Tuple, Iterator
 from config import Config
+from transport import Transport
 
 CUSTOMFIELD = {
     'email': 'customField7',
@@ -35,6 +43,195 @@ STATUS = {
     'On hold': 13,
     'Rejected': 14
 }
+# fields the account and consolidation assets read from member tasks
+TASK_FIELDS = ['id', 'subject', 'lockVersion'] + [
+    CUSTOMFIELD[name] for name in ('email', 'firstname', 'lastname', 'username', 'nextcloud', 'openproject')]
+DEFAULT_PAGE_SIZE = 20
+DEFAULT_PAGE_WORKERS = 4
+
+
+class IncompleteCollectionError(Exception):
+    """
+    Raised by strict collection fetches when a page could not be loaded.
+    """
+
+
+class CollectionFetcher:
+    """
+    Fetch the elements of a paginated OpenProject collection.
+    The first page tells the total, the remaining pages are then fetched
+    concurrently and handed out in offset order.
+    At most `workers` pages are requested ahead of the page being consumed.
+    """
+
+    def __init__(self,
+                 transport: Transport,
+                 page_size: int = DEFAULT_PAGE_SIZE,
+                 workers: int = DEFAULT_PAGE_WORKERS) -> None:
+        """
+        :param transport: transport used for the page requests
+        :param page_size: number of elements requested per page
+        :param workers: max number of pages fetched at the same time
+        """
+        self.transport = transport
+        self.page_size = page_size
+        self.workers = max(workers, 1)
+        self.page_metrics: List[Dict[str, Any]] = []
+
+    def fetch_page(self, url: str, params: Dict[str, Any], offset: int) -> Optional[Dict[str, Any]]:
+        """
+        Fetch a single page and record its latency.
+        :param url: collection url
+        :param params: query parameters without offset and pageSize
+        :param offset: page number, starting at 1
+        :return: decoded page or None if the request fails
+        """
+        page_params = {**params, 'offset': offset, 'pageSize': self.page_size}
+        start = time.perf_counter()
+        response = self.transport.get(url, params=page_params)
+        elapsed = time.perf_counter() - start
+        self.page_metrics.append({
+            'offset': offset,
+            'status_code': response.status_code,
+            'seconds': elapsed
+        })
+        if response.status_code != 200:
+            print(f"Failed to fetch page {offset} of {url}. Status code: {response.status_code}")
+            return None
+        return response.json()
+
+    def iter_pages(self,
+                   url: str,
+                   params: Optional[Dict[str, Any]] = None,
+                   strict: bool = False) -> Iterator[Dict[str, Any]]:
+        """
+        Yield the decoded pages of a collection in offset order.
+        Later pages are already in flight while the caller processes the current one.
+        Iteration stops at the first page that fails.
+        :param url: collection url
+        :param params: additional query parameters, e.g. filters
+        :param strict: raise IncompleteCollectionError instead of stopping silently at a failed page
+        """
+        params = params or {}
+        self.page_metrics = []
+        first = self.fetch_page(url, params, 1)
+        if first is None:
+            if strict:
+                raise IncompleteCollectionError(f"Failed to fetch page 1 of {url}")
+            return
+        # responses restricted by `select` carry no pageSize, the first page shows the effective size
+        page_size = first.get('pageSize') or len(first.get('_embedded', {}).get('elements', [])) or self.page_size
+        pages = math.ceil(first.get('total', 0) / page_size)
+        if pages <= 1:
+            yield first
+            return
+        offsets = iter(range(2, pages + 1))
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = deque(pool.submit(self.fetch_page, url, params, offset)
+                            for offset in itertools.islice(offsets, self.workers))
+            yield first
+            while pending:
+                page = pending.popleft().result()
+                if page is None:
+                    if strict:
+                        raise IncompleteCollectionError(f"Failed to fetch {url} after {len(self.page_metrics)} pages")
+                    break
+                offset = next(offsets, None)
+                if offset is not None:
+                    pending.append(pool.submit(self.fetch_page, url, params, offset))
+                yield page
+
+    def iter_elements(self,
+                      url: str,
+                      params: Optional[Dict[str, Any]] = None,
+                      strict: bool = False) -> Iterator[Dict[str, Any]]:
+        """
+        Yield the elements of a collection page by page.
+        :param url: collection url
+        :param params: additional query parameters, e.g. filters
+        :param strict: raise IncompleteCollectionError if a page fails, see iter_pages
+        """
+        for page in self.iter_pages(url, params, strict=strict):
+            yield from page.get('_embedded', {}).get('elements', [])
+
+    def fetch_all(self, url: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Fetch every page of a collection.
+        If a page fails, the elements of the pages before it are returned.
+        :param url: collection url
+        :param params: additional query parameters, e.g. filters
+        :return: dict with total and elements
+        """
+        total = 0
+        elements = []
+        for page in self.iter_pages(url, params):
+            total = total or page.get('total', 0)
+            elements += page.get('_embedded', {}).get('elements', [])
+        return {'total': total, 'elements': elements}
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Latency summary of the pages fetched by the last fetch_all call.
+        """
+        latencies = [page['seconds'] for page in self.page_metrics]
+        return {
+            'pages': len(latencies),
+            'total_seconds': sum(latencies),
+            'max_seconds': max(latencies, default=0.0),
+            'mean_seconds': sum(latencies) / len(latencies) if latencies else 0.0,
+            'page_metrics': list(self.page_metrics)
+        }
+
+
+class WorkPackageChanges:
+    """
+    Collect status, field changes and comments for one work package and send them together.
+    commit() sends at most one PATCH with all field changes, using the lockVersion tracked on
+    the task, and one POST with all comments.
+    """
+
+    def __init__(self, parser: "WorkPackageParser", task: Dict[str, Any]) -> None:
+        """
+        :param parser: parser used to send the changes
+        :param task: work package with at least id and lockVersion, its lockVersion is kept up to date
+        """
+        self.parser = parser
+        self.task = task
+        self.fields: Dict[str, Any] = {}
+        self.comments: List[str] = []
+
+    def set_status(self, status: str) -> None:
+        """
+        :param status: status name as in STATUS, the last status set wins
+        """
+        self.fields['_links'] = {'status': {'href': f"/api/v3/statuses/{STATUS[status]}"}}
+
+    def set_field(self, field: str, value: Any) -> None:
+        self.fields[field] = value
+
+    def add_comment(self, comment: str) -> None:
+        self.comments.append(comment)
+
+    def discard_fields(self) -> None:
+        """Drop the collected status and field changes, comments are kept."""
+        self.fields = {}
+
+    def commit(self) -> Dict[str, Any]:
+        """
+        Send the collected changes and clear them.
+        :return: dict with the update and comment results of the requests that were sent
+        """
+        result = {}
+        if self.fields:
+            payload = {'lockVersion': self.task['lockVersion'], **self.fields}
+            result['update'] = self.parser.update_member(member_id=self.task['id'], payload=payload)
+            if 'lockVersion' in result['update']:
+                self.task['lockVersion'] = result['update']['lockVersion']
+        if self.comments:
+            result['comment'] = self.parser.add_comment(member_id=self.task['id'], comment="\n\n".join(self.comments))
+        self.fields = {}
+        self.comments = []
+        return result
 
 
 class WorkPackageParser:
@@ -51,8 +248,83 @@ class WorkPackageParser:
         self.config = config or Config().get('workpackages')
         self.apikey = self.config['apikey']
         self.url = self.config['url']
+        self.transport = Transport.for_config(self.config)
+        self.fetcher = CollectionFetcher(self.transport,
+                                         page_size=self.config.get('page_size', DEFAULT_PAGE_SIZE),
+                                         workers=self.config.get('page_workers', DEFAULT_PAGE_WORKERS))
         self.members = []
-        
+        self.member_index: Dict[Tuple[str, Any], List[int]] = {}
+        self.member_positions: Dict[Any, int] = {}
+        self.index_lock = threading.Lock()
+        self.update_metrics = {'updates': 0, 'conflicts': 0, 'resolved': 0, 'failed': 0}
+        self.metrics_lock = threading.Lock()
+
+    @staticmethod
+    def normalize(value: Any) -> str:
+        """
+        Normalize a lookup value for case insensitive matching.
+        """
+        return str(value).strip().lower()
+
+    def member_keys(self, member: Dict[str, Any]) -> List[Tuple[str, Any]]:
+        """
+        Build the index keys of a member workpackage.
+        :param member: member workpackage
+        :return: list of (field, normalized value) tuples
+        """
+        keys = [('subject', self.normalize(member.get('subject', '')))]
+        if member.get(CUSTOMFIELD['email']):
+            keys.append(('email', self.normalize(member[CUSTOMFIELD['email']])))
+        if member.get(CUSTOMFIELD['username']):
+            keys.append(('username', self.normalize(member[CUSTOMFIELD['username']])))
+        if member.get(CUSTOMFIELD['firstname']) and member.get(CUSTOMFIELD['lastname']):
+            keys.append(('name', (self.normalize(member[CUSTOMFIELD['firstname']]),
+                                  self.normalize(member[CUSTOMFIELD['lastname']]))))
+        return keys
+
+    def set_members(self, members: List[Dict[str, Any]]) -> None:
+        """
+        Replace the cached member list and rebuild the lookup indexes.
+        Each index key maps to the sorted list positions of the members carrying it,
+        so lookups can keep the first-in-list match priority of a linear scan.
+        :param members: list of member workpackages
+        """
+        with self.index_lock:
+            self.members = list(members)
+            self.member_index = {}
+            self.member_positions = {}
+            for position, member in enumerate(self.members):
+                self.member_positions[member.get('id')] = position
+                for key in self.member_keys(member):
+                    self.member_index.setdefault(key, []).append(position)
+
+    def index_member(self, member: Dict[str, Any]) -> None:
+        """
+        Add or replace a member in the cached list and its indexes.
+        Does nothing until the member list has been loaded.
+        :param member: member workpackage as returned by the API
+        """
+        if not member or 'id' not in member:
+            return
+        with self.index_lock:
+            if not self.members:
+                return
+            position = self.member_positions.get(member['id'])
+            if position is None:
+                position = len(self.members)
+                self.members.append(member)
+                self.member_positions[member['id']] = position
+            else:
+                for key in self.member_keys(self.members[position]):
+                    positions = self.member_index.get(key, [])
+                    if position in positions:
+                        positions.remove(position)
+                    if not positions:
+                        self.member_index.pop(key, None)
+                self.members[position] = member
+            for key in self.member_keys(member):
+                insort(self.member_index.setdefault(key, []), position)
+
     def check_member_exists(self,
                 subject: str,            
                 email: str,
@@ -68,86 +340,122 @@ class WorkPackageParser:
         :return: Dictionary containing the user data or None if the user does not exist
         """
         if not self.members:
-            self.members = self.get_members().get('members', [])
-        # Check if the user exists in the members list
-        for user in self.members:
-            if user.get(CUSTOMFIELD['email']) and email:
-                if user[CUSTOMFIELD['email']] == email:
-                    return user
-            if user['subject'].lower() == subject.lower():
-                return user
-            if user.get(CUSTOMFIELD['username']) and username:
-                if user[CUSTOMFIELD['username']].lower() == username.lower():
-                    return user
-            if user.get(CUSTOMFIELD['firstname']) and user.get(CUSTOMFIELD['lastname']):
-                if user[CUSTOMFIELD['firstname']].lower() == firstname.lower() and user[CUSTOMFIELD['lastname']].lower() == lastname.lower():
-                    return user
-        return None
-
-    def get_workpackages(self, project_id: int|None = None, status_id: int|None = None) -> List[Dict[str, Any]]:
-        """
-        Get all workpackages from the API for a specific project.
+            self.set_members(self.get_members().get('members', []))
+        keys = [('subject', self.normalize(subject))]
+        if email:
+            keys.append(('email', self.normalize(email)))
+        if username:
+            keys.append(('username', self.normalize(username)))
+        keys.append(('name', (self.normalize(firstname), self.normalize(lastname))))
+        # the member listed first wins, whichever field matched
+        with self.index_lock:
+            positions = [self.member_index[key][0] for key in keys if key in self.member_index]
+            return self.members[min(positions)] if positions else None
+
+    @staticmethod
+    def build_filters(ids: Optional[List[int]] = None,
+                      status_ids: Optional[List[int]] = None,
+                      updated_after: Optional[str] = None,
+                      updated_before: Optional[str] = None,
+                      custom_fields: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        Build an OpenProject filters list.
+        :param ids: match any of these workpackage IDs
+        :param status_ids: match any of these status IDs
+        :param updated_after: ISO 8601 date or datetime, lower bound of updatedAt
+        :param updated_before: ISO 8601 date or datetime, upper bound of updatedAt
+        :param custom_fields: customField name -> value or list of values, booleans become t/f
+        :return: list of filter dicts, serialize with json.dumps
+        """
+        filters = []
+        if ids:
+            filters.append({'id': {'operator': '=', 'values': [str(wp_id) for wp_id in ids]}})
+        if status_ids:
+            filters.append({'status': {'operator': '=', 'values': [str(status) for status in status_ids]}})
+        if updated_after or updated_before:
+            filters.append({'updatedAt': {'operator': '<>d', 'values': [updated_after or '', updated_before or '']}})
+        for field, value in (custom_fields or {}).items():
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            filters.append({field: {'operator': '=', 'values': [
+                ('t' if v else 'f') if isinstance(v, bool) else str(v) for v in values]}})
+        return filters
+
+    def iter_workpackages(self,
+                          project_id: int|None = None,
+                          status_id: int|None = None,
+                          ids: Optional[List[int]] = None,
+                          status_ids: Optional[List[int]] = None,
+                          updated_after: Optional[str] = None,
+                          updated_before: Optional[str] = None,
+                          custom_fields: Optional[Dict[str, Any]] = None,
+                          select: Optional[List[str]] = None,
+                          sort_by: Optional[List[Tuple[str, str]]] = None,
+                          strict: bool = False) -> Iterator[Dict[str, Any]]:
+        """
+        Yield workpackages page by page, filtered on the server.
         :param project_id: The ID of the project to fetch workpackages from
-        :return: List of workpackage dicts or None if request fails
+        :param status_id: single status ID, kept for existing callers
+        :param ids: only these workpackage IDs
+        :param status_ids: match any of these status IDs
+        :param updated_after: ISO 8601 lower bound of updatedAt
+        :param updated_before: ISO 8601 upper bound of updatedAt
+        :param custom_fields: customField name -> value(s) to match
+        :param select: element properties to return, e.g. TASK_FIELDS
+        :param sort_by: (property, 'asc'|'desc') pairs, e.g. [('updatedAt', 'asc')]
+        :param strict: raise IncompleteCollectionError if a page fails instead of yielding a partial result
         """
         if project_id:
             url = f"{self.url}/api/v3/projects/{project_id}/work_packages"
         else:
             url = f"{self.url}/api/v3/work_packages"
         if status_id:
-            params = {
-                "filters": f'[{{"status":{{"operator":"=","values":["{status_id}"]}}}}]'
-            }
-            response = requests.get(url, params=params, auth=('apikey', self.apikey))
-        else:
-            response = requests.get(url, auth=('apikey', self.apikey))
-        if response.status_code == 200:
-            data = response.json()
-            return data.get('_embedded', {}).get('elements', [])
-        else:
-            print(f"Failed to fetch workpackages. Status code: {response.status_code}")
-            return []
-        
+            status_ids = [status_id, *(status_ids or [])]
+        filters = self.build_filters(ids=ids,
+                                     status_ids=status_ids,
+                                     updated_after=updated_after,
+                                     updated_before=updated_before,
+                                     custom_fields=custom_fields)
+        params = {}
+        if filters:
+            params['filters'] = json.dumps(filters)
+        if select:
+            params['select'] = ','.join(['total', 'count'] + [f"elements/{field}" for field in select])
+        if sort_by:
+            params['sortBy'] = json.dumps([list(order) for order in sort_by])
+        yield from self.fetcher.iter_elements(url, params, strict=strict)
+
+    def get_workpackages(self,
+                         project_id: int|None = None,
+                         status_id: int|None = None,
+                         **query) -> List[Dict[str, Any]]:
+        """
+        Get all workpackages from the API, following every page.
+        :param project_id: The ID of the project to fetch workpackages from
+        :param status_id: only return workpackages with this status
+        :param query: further filters, see iter_workpackages
+        :return: List of workpackage dicts, empty if the first request fails
+        """
+        return list(self.iter_workpackages(project_id=project_id, status_id=status_id, **query))
+
+    def iter_members(self) -> Iterator[Dict[str, Any]]:
+        """
+        Yield the member workpackages page by page while later pages are fetched.
+        """
+        yield from self.fetcher.iter_elements(f"{self.url}/api/v3/projects/18/work_packages")
+
     def get_members(self) -> Dict[str, Any]:
         """
-        Get the workpackages from the API.
-        :return:
+        Get all member workpackages of the member project.
+        Pages are fetched concurrently, see CollectionFetcher.
+        :return: dict with total, count and members
         """
         url = f"{self.url}/api/v3/projects/18/work_packages"
-        all_members = []
-        params = {
-            'offset': 1,
-            'pageSize': 20
+        result = self.fetcher.fetch_all(url)
+        return {
+            'total': result['total'],
+            'count': len(result['elements']),
+            'members': result['elements']
         }
-        response = requests.get(url, params=params, auth=('apikey', self.apikey))
-
-        if response.status_code != 200:
-            return {"members": [], "total": 0, "count": 0}
-        response_data = response.json()
-        total_members = response_data['total']
-        if '_embedded' in response_data and 'elements' in response_data['_embedded']:
-            all_members += response_data['_embedded']['elements']
-
-        while response_data['_links'].get('nextByOffset'):
-            url = f"{self.url}{response_data['_links']['nextByOffset']['href']}"
-            response = requests.get(url, auth=('apikey', self.apikey))
-            if response.status_code != 200:
-                break
-            response_data = response.json()
-            if '_embedded' in response_data and 'elements' in response_data['_embedded']:
-                all_members += response_data['_embedded']['elements']
-
-            # Check if we've retrieved all users
-            if len(all_members) >= total_members:
-                break
-
-        # Build the final result
-        result = {
-            'total': total_members,
-            'count': len(all_members),
-            'members': all_members
-        }
-        return result
 
     def get_member(self, member_id: int) -> Optional[Dict[str, Any]]:
         """
@@ -161,7 +469,7 @@ class WorkPackageParser:
             'Content-Type': 'application/json',
             'Accept': 'application/json'
         }
-        response = requests.get(url, auth=('apikey', self.apikey), headers=headers)
+        response = self.transport.get(url, headers=headers)
 
         if response.status_code == 200:
             return response.json()
@@ -191,14 +499,15 @@ class WorkPackageParser:
         headers = {
             'content-type': 'application/json'
         }
-        response = requests.post(
+        response = self.transport.post(
             url=url,
-            auth=('apikey', self.apikey),
             data=json.dumps(payload),
             headers=headers
         )
         if response.status_code == 201: # Created
-            return response.json()
+            member = response.json()
+            self.index_member(member)
+            return member
         else:
             return {"error": "Failed to create member"}
 
@@ -275,6 +584,8 @@ class WorkPackageParser:
         # TODO: set telephone etc if empy in member
         res = self.update_member(member_id=member_task['id'], payload=payload)
         if res is not None:
+            if 'lockVersion' in res:
+                member_task['lockVersion'] = res['lockVersion']
             return res
         return None
 
@@ -292,8 +603,17 @@ class WorkPackageParser:
             }    
         }
         result =self.update_member(member_id=task['id'],payload=payload)
+        if 'lockVersion' in result:
+            task['lockVersion'] = result['lockVersion']
         return result
 
+    def changes(self, task: Dict[str, Any]) -> WorkPackageChanges:
+        """
+        Start collecting changes for a workpackage, see WorkPackageChanges.
+        :param task: The workpackage to change
+        """
+        return WorkPackageChanges(self, task)
+
     def add_comment(self, member_id: str, comment: str) -> Dict[str, Any]:
         """
         Add a comment to a workpackage.
@@ -310,9 +630,8 @@ class WorkPackageParser:
                 'raw': comment
             }
         }
-        response = requests.post(
+        response = self.transport.post(
             url=url,
-            auth=('apikey', self.apikey),
             data=json.dumps(payload),
             headers=headers
         )
@@ -323,28 +642,57 @@ class WorkPackageParser:
             print(f"Response content: {response.text}")
             return {"error": "Failed to add comment"}
 
-    def update_member(self, member_id: str, payload) -> Dict[str, Any]:
-        """
-        update workpackage entry with given member details
-        :param member_id:
-        :param payload:
-        """
+    def send_update(self, member_id: str, payload) -> requests.Response:
         url = f"{self.url}/api/v3/work_packages/{member_id}"
         headers = {
             'content-type': 'application/json'
         }
-        response = requests.patch(
+        response = self.transport.patch(
             url=url,
-            auth=('apikey', self.apikey),
             data=json.dumps(payload),
             headers=headers
         )
+        return response
+
+    def count_update(self, key: str) -> None:
+        with self.metrics_lock:
+            self.update_metrics[key] += 1
+
+    def conflict_metrics(self) -> Dict[str, Any]:
+        """
+        Optimistic locking statistics of update_member since the parser was created.
+        :return: dict with updates, conflicts, resolved, failed and conflict_rate
+        """
+        with self.metrics_lock:
+            metrics = dict(self.update_metrics)
+        metrics['conflict_rate'] = metrics['conflicts'] / metrics['updates'] if metrics['updates'] else 0.0
+        return metrics
+
+    def update_member(self, member_id: str, payload) -> Dict[str, Any]:
+        """
+        update workpackage entry with given member details
+        On a lockVersion conflict (409) the workpackage is fetched again and
+        the payload is sent once more with the current lockVersion.
+        :param member_id:
+        :param payload:
+        """
+        # one update per call, the retry after a conflict is not counted again
+        self.count_update('updates')
+        response = self.send_update(member_id, payload)
+        if response.status_code == 409:
+            self.count_update('conflicts')
+            current = self.get_member(member_id)
+            if current is not None:
+                response = self.send_update(member_id, {**payload, 'lockVersion': current['lockVersion']})
+            self.count_update('resolved' if response.status_code in [200, 204] else 'failed')
         print(f"Update response status code: {response.status_code}")
         print(f"Update response content: {response.text}")
         
         if response.status_code in [200, 204]:  # Success - could be 200 or 204
             if response.status_code == 200 and response.text:
-                return response.json()
+                member = response.json()
+                self.index_member(member)
+                return member
             else:
                 return {'success': True, 'status_code': response.status_code}
         else:   # Error occurred
@@ -359,9 +707,7 @@ class WorkPackageParser:
         headers = {
             'content-type': 'application/json'
         }
-        response = requests.delete(url=url,
-                                   auth=('apikey', self.apikey),
-                                   headers=headers)
+        response = self.transport.delete(url=url, headers=headers)
         if response.status_code == 204:
             return True
         else:
@@ -427,6 +773,10 @@ class UserParser:
         self.config = config or Config().get('workpackages')
         self.apikey = self.config['apikey']
         self.url = self.config['url']
+        self.transport = Transport.for_config(self.config)
+        self.fetcher = CollectionFetcher(self.transport,
+                                         page_size=self.config.get('page_size', DEFAULT_PAGE_SIZE),
+                                         workers=self.config.get('page_workers', DEFAULT_PAGE_WORKERS))
         self.users = []
 
     def check_user(self,
@@ -458,8 +808,7 @@ class UserParser:
         :return: Dictionary containing the user data or None if the user does not exist.
         """
         url = f"{self.url}/api/v3/users/{user_id}"
-        response = requests.get(url,
-                                auth=('apikey', self.apikey))
+        response = self.transport.get(url)
         if response.status_code == 200:
             return response.json()
         else:
@@ -490,9 +839,8 @@ class UserParser:
         headers = {
             'content-type': 'application/json'
         }
-        response = requests.post(
+        response = self.transport.post(
             url=url,
-            auth=('apikey', self.apikey),
             data=json.dumps(payload),
             headers=headers)
         if response.status_code == 201: # Created
@@ -501,47 +849,25 @@ class UserParser:
             return {}
 
 
-    def get_users(self) -> Dict[str, Any]:
+    def iter_users(self) -> Iterator[Dict[str, Any]]:
         """
-        Get all users from the API using pagination.
-        Continues fetching pages until all users are retrieved (total == count).
-        Handles potential duplicate users by tracking user IDs.
-        :return: Dictionary containing all users
+        Yield all users page by page while later pages are fetched.
         """
-        url = f"{self.url}/api/v3/users"  # Adjust this value based on API limits
-        all_users = []
-        params = {
-            'offset': 1,
-            'pageSize': 20
-        }
-        response = requests.get(url, params=params, auth=('apikey', self.apikey))
+        yield from self.fetcher.iter_elements(f"{self.url}/api/v3/users")
 
-        if response.status_code != 200:
-            return {'users': [], 'total': 0, 'count': 0}
-        response_data = response.json()
-        total_users = response_data['total']
-        if '_embedded' in response_data and 'elements' in response_data['_embedded']:
-            all_users += response_data['_embedded']['elements']
-
-        while response_data['_links'].get('nextByOffset'):
-            url = f"{self.url}{response_data['_links']['nextByOffset']['href']}"
-            response = requests.get(url, auth=('apikey', self.apikey))
-            if response.status_code != 200:
-                break
-            response_data = response.json()
-            if '_embedded' in response_data and 'elements' in response_data['_embedded']:
-                all_users += response_data['_embedded']['elements']
-
-            # Check if we've retrieved all users
-            if len(all_users) >= total_users:
-                break
-        # Build the final result
-        result = {
-            'total': total_users,
-            'count': len(all_users),
-            'users': all_users
+    def get_users(self) -> Dict[str, Any]:
+        """
+        Get all users from the API.
+        Pages are fetched concurrently, see CollectionFetcher.
+        :return: dict with total, count and users
+        """
+        url = f"{self.url}/api/v3/users"
+        result = self.fetcher.fetch_all(url)
+        return {
+            'total': result['total'],
+            'count': len(result['elements']),
+            'users': result['elements']
         }
-        return result
 
     # def build_user_dict(self, response: Dict[str, Any]) -> Dict[str, Any]:
     #     """
@@ -606,7 +932,7 @@ class UserParser:
         }
 
         try:
-            response = requests.post(url, json=payload, auth=('apikey', self.apikey), headers=headers)
+            response = self.transport.post(url, json=payload, headers=headers)
             return response.status_code == 201
         except requests.exceptions.RequestException:
             return False
@@ -622,7 +948,7 @@ class UserParser:
             'Accept': 'application/json'
         }
         try:
-            response = requests.post(url, json=payload, auth=('apikey', self.apikey), headers=headers)
+            response = self.transport.post(url, json=payload, headers=headers)
             return response.status_code == 201
         except requests.exceptions.RequestException:
             return False
\ No newline at end of file
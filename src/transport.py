@@ -0,0 +1,379 @@
+import asyncio
+import random
+import threading
+import time
+import niquests
+import requests
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+from typing import Optional, Dict, Any, Tuple, Callable, Awaitable, TypeVar
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 30
+DEFAULT_RATE_LIMIT = 10
+DEFAULT_RATE_BURST = 20
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_BACKOFF = 0.5
+DEFAULT_MAX_BACKOFF = 30
+DEFAULT_RETRY_RATIO = 0.2
+DEFAULT_RETRY_CAPACITY = 10
+# 429 and 503 mean the request was not processed, the others only for idempotent requests
+RETRY_ALWAYS = {429, 503}
+RETRY_IDEMPOTENT = {500, 502, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE', 'PROPFIND', 'MKCOL'}
+# network errors of requests (OpenProject) and niquests (nc_py_api), niquests' do not derive from requests'
+RETRY_EXCEPTIONS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    niquests.exceptions.ConnectionError, niquests.exceptions.Timeout,
+                    ConnectionError, TimeoutError)
+
+T = TypeVar('T')
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter: rate tokens per second, at most burst tokens saved up.
+    """
+
+    def __init__(self, rate: float = DEFAULT_RATE_LIMIT, burst: int = DEFAULT_RATE_BURST) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Take one token, possibly ahead of time.
+        :return: seconds to wait before the token may be used
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(-self.tokens / self.rate, 0.0)
+
+
+class RetryBudget:
+    """
+    Limit retries to a fraction of the requests, so an overloaded backend is not flooded with retries.
+    Every request deposits ratio tokens (up to capacity), every retry withdraws one.
+    """
+
+    def __init__(self, ratio: float = DEFAULT_RETRY_RATIO, capacity: float = DEFAULT_RETRY_CAPACITY) -> None:
+        self.ratio = ratio
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self._lock = threading.Lock()
+
+    def deposit(self) -> None:
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class RequestExecutor:
+    """
+    Run calls against one backend with rate limiting, exponential backoff and a retry budget.
+    Use RequestExecutor.for_config() to share one executor per backend url.
+    config keys (all optional):
+        rate_limit: float = 10, requests per second
+        rate_burst: int = 20, requests allowed at once after an idle period
+        max_retries: int = 4, retries per call
+        backoff: float = 0.5, seconds before the first retry, doubled for every further retry
+        max_backoff: float = 30, upper bound for the backoff
+        retry_ratio: float = 0.2, retries earned per request
+        retry_capacity: float = 10, retries that can be saved up
+    A Retry-After header on 429/503 responses takes precedence over the backoff.
+    """
+    _instances: Dict[str, "RequestExecutor"] = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self,
+                 rate_limit: float = DEFAULT_RATE_LIMIT,
+                 rate_burst: int = DEFAULT_RATE_BURST,
+                 max_retries: int = DEFAULT_MAX_RETRIES,
+                 backoff: float = DEFAULT_BACKOFF,
+                 max_backoff: float = DEFAULT_MAX_BACKOFF,
+                 retry_ratio: float = DEFAULT_RETRY_RATIO,
+                 retry_capacity: float = DEFAULT_RETRY_CAPACITY) -> None:
+        self.bucket = TokenBucket(rate_limit, rate_burst)
+        self.budget = RetryBudget(retry_ratio, retry_capacity)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.sleep = time.sleep
+        self.async_sleep = asyncio.sleep
+        self.metrics = {'calls': 0, 'retries': 0, 'budget_exhausted': 0, 'throttled_seconds': 0.0}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "RequestExecutor":
+        return cls(rate_limit=config.get('rate_limit', DEFAULT_RATE_LIMIT),
+                   rate_burst=config.get('rate_burst', DEFAULT_RATE_BURST),
+                   max_retries=config.get('max_retries', DEFAULT_MAX_RETRIES),
+                   backoff=config.get('backoff', DEFAULT_BACKOFF),
+                   max_backoff=config.get('max_backoff', DEFAULT_MAX_BACKOFF),
+                   retry_ratio=config.get('retry_ratio', DEFAULT_RETRY_RATIO),
+                   retry_capacity=config.get('retry_capacity', DEFAULT_RETRY_CAPACITY))
+
+    @classmethod
+    def for_config(cls, config: Dict[str, Any]) -> "RequestExecutor":
+        """
+        Return the shared executor for a backend, creating it on first use.
+        :param config: config section containing at least url
+        """
+        with cls._instances_lock:
+            if config['url'] not in cls._instances:
+                cls._instances[config['url']] = cls.from_config(config)
+            return cls._instances[config['url']]
+
+    def count(self, key: str, value: float = 1) -> None:
+        with self._lock:
+            self.metrics[key] += value
+
+    def throttle_delay(self) -> float:
+        delay = self.bucket.reserve()
+        if delay:
+            self.count('throttled_seconds', delay)
+        return delay
+
+    @staticmethod
+    def retry_after(headers: Any) -> Optional[float]:
+        """Seconds requested by a Retry-After header, given either as seconds or as HTTP date."""
+        value = headers.get('Retry-After') if headers is not None else None
+        if not value:
+            return None
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            try:
+                return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+            except (TypeError, ValueError):
+                return None
+
+    def retry_delay(self,
+                    attempt: int,
+                    result: Any,
+                    error: Optional[BaseException],
+                    idempotent: bool,
+                    max_retries: int) -> Optional[float]:
+        """
+        Decide whether a call is retried.
+        Responses and exceptions carrying a status_code (nc_py_api) are retried on 429/503,
+        idempotent calls also on 500/502/504 and on connection errors and timeouts.
+        :return: seconds to wait before the next attempt, None if the call is not retried
+        """
+        source = error if error is not None else result
+        status = getattr(source, 'status_code', None)
+        if status in RETRY_ALWAYS or idempotent and status in RETRY_IDEMPOTENT:
+            retryable = True
+        else:
+            retryable = idempotent and isinstance(error, RETRY_EXCEPTIONS)
+        if not retryable or attempt >= max_retries:
+            return None
+        if not self.budget.withdraw():
+            self.count('budget_exhausted')
+            return None
+        self.count('retries')
+        response = getattr(error, 'response', None) if error is not None else result
+        retry_after = self.retry_after(getattr(response, 'headers', None))
+        if retry_after is not None:
+            return retry_after
+        return min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def execute(self,
+                send: Callable[[], T],
+                idempotent: bool = True,
+                max_retries: Optional[int] = None,
+                stats: Optional[Dict[str, int]] = None) -> T:
+        """
+        Call send() until it succeeds, fails permanently or runs out of retries.
+        The last response is returned, the last exception is raised.
+        :param send: performs one attempt
+        :param idempotent: whether repeating the call is safe after a server error or timeout
+        :param max_retries: overrides the configured max_retries
+        :param stats: optional dict whose 'retries' entry is incremented on every retry
+        """
+        max_retries = self.max_retries if max_retries is None else max_retries
+        self.count('calls')
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            delay = self.throttle_delay()
+            if delay:
+                self.sleep(delay)
+            result, error = None, None
+            try:
+                result = send()
+            except Exception as e:
+                error = e
+            delay = self.retry_delay(attempt, result, error, idempotent, max_retries)
+            if delay is None:
+                if error is not None:
+                    raise error
+                return result
+            if stats is not None:
+                stats['retries'] = stats.get('retries', 0) + 1
+            attempt += 1
+            self.sleep(delay)
+
+    async def execute_async(self,
+                            send: Callable[[], Awaitable[T]],
+                            idempotent: bool = True,
+                            max_retries: Optional[int] = None) -> T:
+        """Like execute() for coroutines, waiting with asyncio.sleep."""
+        max_retries = self.max_retries if max_retries is None else max_retries
+        self.count('calls')
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            delay = self.throttle_delay()
+            if delay:
+                await self.async_sleep(delay)
+            result, error = None, None
+            try:
+                result = await send()
+            except Exception as e:
+                error = e
+            delay = self.retry_delay(attempt, result, error, idempotent, max_retries)
+            if delay is None:
+                if error is not None:
+                    raise error
+                return result
+            attempt += 1
+            await self.async_sleep(delay)
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that counts how many new connections its pools open.
+    Every request that does not open a connection reused a pooled one.
+    Counting uses urllib3's public extension points: the pool manager's
+    pool_classes_by_scheme and the pools' ConnectionCls.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        self.connections_opened = 0
+        self._counter_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def count_connection(self) -> None:
+        with self._counter_lock:
+            self.connections_opened += 1
+
+    def counting_pool(self, pool_cls: type) -> type:
+        """Subclass of a connection pool class whose connections report to this adapter."""
+        adapter = self
+
+        class CountingConnection(pool_cls.ConnectionCls):
+            def __init__(self, *args, **kwargs) -> None:
+                adapter.count_connection()
+                super().__init__(*args, **kwargs)
+
+        return type(pool_cls.__name__, (pool_cls,), {'ConnectionCls': CountingConnection})
+
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            scheme: self.counting_pool(pool_cls)
+            for scheme, pool_cls in self.poolmanager.pool_classes_by_scheme.items()
+        }
+
+
+class Transport:
+    """
+    Connection-pooled HTTP transport shared by all parsers talking to the same API.
+    Use Transport.for_config() to get the shared instance for a config section.
+    config keys (all optional except url and apikey):
+        pool_size: int = 10, max keep-alive connections per host
+        connect_timeout: float = 5, seconds
+        read_timeout: float = 30, seconds
+    Requests are rate limited and retried as configured for RequestExecutor.
+    """
+    _instances: Dict[Tuple[str, str], "Transport"] = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self,
+                 auth: Optional[Tuple[str, str]] = None,
+                 pool_size: int = DEFAULT_POOL_SIZE,
+                 connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout: float = DEFAULT_READ_TIMEOUT,
+                 executor: Optional[RequestExecutor] = None) -> None:
+        self.executor = executor or RequestExecutor()
+        self.adapter = CountingHTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.auth = auth
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        self.timeout = (connect_timeout, read_timeout)
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_config(cls, config: Dict[str, Any]) -> "Transport":
+        """
+        Return the shared transport for an API config section, creating it on first use.
+        :param config: config section containing at least url and apikey
+        """
+        key = (config['url'], config['apikey'])
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(
+                    auth=('apikey', config['apikey']),
+                    pool_size=config.get('pool_size', DEFAULT_POOL_SIZE),
+                    connect_timeout=config.get('connect_timeout', DEFAULT_CONNECT_TIMEOUT),
+                    read_timeout=config.get('read_timeout', DEFAULT_READ_TIMEOUT),
+                    executor=RequestExecutor.from_config(config))
+            return cls._instances[key]
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Send a request through the pooled session, rate limited and retried by the executor.
+        :param method: HTTP method
+        :param url: absolute url
+        :param kwargs: passed on to requests.Session.request
+        """
+        kwargs.setdefault('timeout', self.timeout)
+
+        def send() -> requests.Response:
+            with self._lock:
+                self.requests += 1
+            return self.session.request(method, url, **kwargs)
+
+        return self.executor.execute(send, idempotent=method.upper() in IDEMPOTENT_METHODS)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def patch(self, url: str, **kwargs) -> requests.Response:
+        return self.request('PATCH', url, **kwargs)
+
+    def delete(self, url: str, **kwargs) -> requests.Response:
+        return self.request('DELETE', url, **kwargs)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Connection usage counters since the transport was created.
+        :return: dict with requests, connections_opened, connections_reused and the executor metrics
+        """
+        opened = self.adapter.connections_opened
+        return {
+            'requests': self.requests,
+            'connections_opened': opened,
+            'connections_reused': max(self.requests - opened, 0),
+            **self.executor.metrics
+        }
+
+    def close(self) -> None:
+        self.session.close()
@@ -0,0 +1,323 @@
+"""
+In-process stand-in for the parts of the OpenProject API v3 used by openproject.py.
+
+Serves HAL+JSON work packages, users, activities and statuses with offset
+pagination (nextByOffset links), lockVersion conflicts (409) and a configurable
+latency per request, so parsers and pipelines can be tested and benchmarked offline:
+
+    with FakeOpenProject(latency=0.01) as server:
+        server.add_work_packages(100, status='Scheduled')
+        wp = WorkPackageParser(server.config())
+
+Run this file to benchmark fetching work packages against it.
+"""
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+import argparse
+import base64
+import json
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+from urllib.parse import urlparse, parse_qs
+from openproject import STATUS, CUSTOMFIELD
+
+CLOSED_STATUSES = {STATUS['Closed'], STATUS['Rejected']}
+MAX_PAGE_SIZE = 100
+
+
+def now() -> str:
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+class FakeOpenProject:
+    """
+    Fake OpenProject server on a free local port.
+    :param apikey: api key accepted for basic auth as apikey:<apikey>
+    :param latency: seconds every request is delayed
+    :param max_page_size: larger pageSize values are clamped, like OpenProject does
+    """
+
+    def __init__(self, apikey: str = 'fake-api-key', latency: float = 0.0, max_page_size: int = MAX_PAGE_SIZE) -> None:
+        self.apikey = apikey
+        self.latency = latency
+        self.max_page_size = max_page_size
+        self.work_packages: Dict[int, Dict[str, Any]] = {}
+        self.users: Dict[int, Dict[str, Any]] = {}
+        self.activities: Dict[int, List[Dict[str, Any]]] = {}
+        self.requests: List[str] = []
+        self.conflicts = 0
+        self.lock = threading.RLock()
+        self.ids = iter(range(1, sys.maxsize))
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def config(self, **overrides) -> Dict[str, Any]:
+        """Config section for WorkPackageParser and UserParser, not rate limited."""
+        return {'url': self.url, 'apikey': self.apikey, 'rate_limit': 10000, 'rate_burst': 10000, **overrides}
+
+    def start(self) -> "FakeOpenProject":
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "FakeOpenProject":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+    # data
+
+    def add_work_package(self, project_id: int = 18, status: str = 'New', **fields) -> Dict[str, Any]:
+        """Add a work package, fields are set as given, e.g. subject or customField7."""
+        with self.lock:
+            wp_id = next(self.ids)
+            self.work_packages[wp_id] = {
+                '_type': 'WorkPackage',
+                'id': wp_id,
+                'subject': f"member-{wp_id}",
+                'lockVersion': 0,
+                'createdAt': now(),
+                'updatedAt': now(),
+                **fields,
+                '_links': {
+                    'self': {'href': f"/api/v3/work_packages/{wp_id}"},
+                    'project': {'href': f"/api/v3/projects/{project_id}"},
+                    'status': {'href': f"/api/v3/statuses/{STATUS[status]}", 'title': status},
+                },
+            }
+            self.activities[wp_id] = []
+            return self.work_packages[wp_id]
+
+    def add_work_packages(self, count: int, **kwargs) -> List[Dict[str, Any]]:
+        return [self.add_work_package(**kwargs) for _ in range(count)]
+
+    def add_user(self, login: str, **fields) -> Dict[str, Any]:
+        with self.lock:
+            user_id = next(self.ids)
+            self.users[user_id] = {
+                '_type': 'User',
+                'id': user_id,
+                'login': login,
+                'name': f"{fields.get('firstName', '')} {fields.get('lastName', '')}".strip() or login,
+                'email': f"{login}@example.org",
+                'status': 'active',
+                'createdAt': now(),
+                'updatedAt': now(),
+                **fields,
+                '_links': {'self': {'href': f"/api/v3/users/{user_id}"}},
+            }
+            return self.users[user_id]
+
+    def touch(self, wp_id: int) -> None:
+        """Simulate a concurrent edit: the next PATCH with the old lockVersion conflicts."""
+        with self.lock:
+            self.work_packages[wp_id]['lockVersion'] += 1
+            self.work_packages[wp_id]['updatedAt'] = now()
+
+    @staticmethod
+    def status_id(wp: Dict[str, Any]) -> int:
+        return int(wp['_links']['status']['href'].rsplit('/', 1)[-1])
+
+    # collections
+
+    def matches(self, wp: Dict[str, Any], filters: List[Dict[str, Any]]) -> bool:
+        for entry in filters:
+            (field, condition), = entry.items()
+            operator, values = condition['operator'], condition.get('values', [])
+            if field == 'status':
+                status = self.status_id(wp)
+                if operator == 'o' and status in CLOSED_STATUSES:
+                    return False
+                if operator == '=' and str(status) not in values:
+                    return False
+            elif field == 'id':
+                if str(wp['id']) not in values:
+                    return False
+            elif field == 'updatedAt' and operator == '<>d':
+                after, before = (values + ['', ''])[:2]
+                if after and wp['updatedAt'] < after or before and wp['updatedAt'] > before:
+                    return False
+            elif operator == '=':
+                value = wp.get(field)
+                value = ('t' if value else 'f') if isinstance(value, bool) else str(value)
+                if value not in values:
+                    return False
+        return True
+
+    def collection(self, elements: List[Dict[str, Any]], path: str, query: Dict[str, str]) -> Dict[str, Any]:
+        """HAL collection page for offset/pageSize, restricted by select like OpenProject."""
+        offset = max(int(query.get('offset', 1)), 1)
+        page_size = min(int(query.get('pageSize', 20)), self.max_page_size)
+        page = elements[(offset - 1) * page_size:offset * page_size]
+        links = {'self': {'href': f"{path}?offset={offset}&pageSize={page_size}"}}
+        if offset * page_size < len(elements):
+            links['nextByOffset'] = {'href': f"{path}?offset={offset + 1}&pageSize={page_size}"}
+        if offset > 1:
+            links['previousByOffset'] = {'href': f"{path}?offset={offset - 1}&pageSize={page_size}"}
+        result = {'_type': 'Collection', 'total': len(elements), 'count': len(page), 'pageSize': page_size,
+                  'offset': offset, '_embedded': {'elements': page}, '_links': links}
+        if 'select' in query:
+            selected = query['select'].split(',')
+            fields = [field.split('/', 1)[1] for field in selected if field.startswith('elements/')]
+            result = {key: value for key, value in result.items() if key in selected}
+            result['_embedded'] = {'elements': [{field: element.get(field) for field in fields} for element in page]}
+        return result
+
+    # requests
+
+    def handle(self, method: str, path: str, query: Dict[str, str], body: Any) -> tuple:
+        """
+        Dispatch one request.
+        :return: (status code, response body or None)
+        """
+        with self.lock:
+            self.requests.append(f"{method} {path}")
+            match = re.fullmatch(r'/api/v3/(?:projects/(\d+)/)?work_packages', path)
+            if match and method == 'GET':
+                filters = json.loads(query['filters']) if 'filters' in query else [{'status': {'operator': 'o'}}]
+                project = f"/api/v3/projects/{match.group(1)}" if match.group(1) else None
+                elements = [wp for wp in self.work_packages.values()
+                            if (project is None or wp['_links']['project']['href'] == project)
+                            and self.matches(wp, filters)]
+                return 200, self.collection(elements, path, query)
+            if match and method == 'POST':
+                body.pop('lockVersion', None)
+                links = body.pop('_links', {})
+                status = int(links.get('status', {}).get('href', f"/{STATUS['New']}").rsplit('/', 1)[-1])
+                status_name = next(name for name, value in STATUS.items() if value == status)
+                return 201, self.add_work_package(project_id=int(match.group(1) or 18), status=status_name, **body)
+            match = re.fullmatch(r'/api/v3/work_packages/(\d+)(/activities)?', path)
+            if match:
+                wp = self.work_packages.get(int(match.group(1)))
+                if wp is None:
+                    return 404, {'_type': 'Error', 'errorIdentifier': 'urn:openproject-org:api:v3:errors:NotFound'}
+                if match.group(2) and method == 'POST':
+                    activity = {'_type': 'Activity::Comment', 'id': next(self.ids),
+                                'comment': {'raw': body['comment']['raw']}, 'createdAt': now()}
+                    self.activities[wp['id']].append(activity)
+                    return 201, activity
+                if match.group(2):
+                    return 200, self.collection(self.activities[wp['id']], path, query)
+                if method == 'GET':
+                    return 200, wp
+                if method == 'PATCH':
+                    if body.get('lockVersion') != wp['lockVersion']:
+                        self.conflicts += 1
+                        return 409, {'_type': 'Error',
+                                     'errorIdentifier': 'urn:openproject-org:api:v3:errors:UpdateConflict'}
+                    body.pop('lockVersion')
+                    if 'status' in body.get('_links', {}):
+                        status = int(body['_links']['status']['href'].rsplit('/', 1)[-1])
+                        wp['_links']['status'] = {'href': f"/api/v3/statuses/{status}",
+                                                  'title': next(n for n, v in STATUS.items() if v == status)}
+                    body.pop('_links', None)
+                    wp.update(body)
+                    wp['lockVersion'] += 1
+                    wp['updatedAt'] = now()
+                    return 200, wp
+                if method == 'DELETE':
+                    del self.work_packages[wp['id']]
+                    return 204, None
+            if path == '/api/v3/statuses':
+                statuses = [{'_type': 'Status', 'id': value, 'name': name, 'isClosed': value in CLOSED_STATUSES}
+                            for name, value in STATUS.items()]
+                return 200, self.collection(statuses, path, {'pageSize': len(statuses)})
+            if path == '/api/v3/users' and method == 'GET':
+                return 200, self.collection(list(self.users.values()), path, query)
+            if path == '/api/v3/users' and method == 'POST':
+                if any(user['login'] == body.get('login') for user in self.users.values()):
+                    return 422, {'_type': 'Error', 'message': 'Username has already been taken.'}
+                return 201, self.add_user(**body)
+            match = re.fullmatch(r'/api/v3/users/(\d+)', path)
+            if match:
+                user = self.users.get(int(match.group(1)))
+                return (200, user) if user else (404, {'_type': 'Error'})
+            if re.fullmatch(r'/api/v3/groups/\d+/users', path) or path == '/api/v3/memberships':
+                return 201, {'_type': 'Membership' if 'memberships' in path else 'Group'}
+            return 404, {'_type': 'Error', 'message': f"{method} {path} is not supported by the fake"}
+
+    def handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def dispatch(self, method):
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b''
+                if server.latency:
+                    time.sleep(server.latency)
+                expected = 'Basic ' + base64.b64encode(f"apikey:{server.apikey}".encode()).decode()
+                if self.headers.get('Authorization') != expected:
+                    status = 401
+                    payload = json.dumps({'_type': 'Error',
+                                          'errorIdentifier': 'urn:openproject-org:api:v3:errors:Unauthenticated'}).encode()
+                else:
+                    url = urlparse(self.path)
+                    query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                    # serialize under the lock, concurrent requests may modify the same work package
+                    with server.lock:
+                        status, body = server.handle(method, url.path, query, json.loads(raw) if raw else {})
+                        payload = json.dumps(body).encode() if body is not None else b''
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/hal+json; charset=utf-8')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                self.dispatch('GET')
+
+            def do_POST(self):
+                self.dispatch('POST')
+
+            def do_PATCH(self):
+                self.dispatch('PATCH')
+
+            def do_DELETE(self):
+                self.dispatch('DELETE')
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def benchmark(work_packages: int, latency: float, page_size: int, workers: int) -> Dict[str, Any]:
+    """Fetch all scheduled member tasks from a fake server and report throughput and latency."""
+    from openproject import WorkPackageParser, TASK_FIELDS
+    with FakeOpenProject(latency=latency) as server:
+        server.add_work_packages(work_packages, status='Scheduled', **{CUSTOMFIELD['nextcloud']: True})
+        wp = WorkPackageParser(server.config(page_size=page_size, page_workers=workers))
+        start = time.perf_counter()
+        tasks = wp.get_workpackages(project_id=18, status_id=STATUS['Scheduled'], select=TASK_FIELDS)
+        seconds = time.perf_counter() - start
+        metrics = wp.fetcher.metrics()
+        return {'work_packages': len(tasks), 'seconds': round(seconds, 3),
+                'work_packages_per_second': round(len(tasks) / seconds, 1),
+                'pages': metrics['pages'], 'mean_page_seconds': round(metrics['mean_seconds'], 4),
+                'max_page_seconds': round(metrics['max_seconds'], 4), **wp.transport.stats()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark WorkPackageParser against a fake OpenProject")
+    parser.add_argument('--work-packages', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+    print(json.dumps(benchmark(args.work_packages, args.latency, args.page_size, args.workers), indent=2))
@@ -1,5 +1,28 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+import importlib
+import tempfile
 import unittest
-from couchdbclient import Client
+from unittest.mock import patch, MagicMock
+from couchdbclient import Client, CHECKPOINT_DOC
+from openproject import WorkPackageParser, UserParser, CUSTOMFIELD, STATUS
+from tests.fake_openproject import FakeOpenProject
+from tests.test_couchdbclient import FakeDatabase, offline_client
+
+OFFLINE_CONFIG = """
+[workpackages]
+url = "http://127.0.0.1:9"
+apikey = "offline"
+[users]
+url = "http://127.0.0.1:9"
+apikey = "offline"
+[nextcloud]
+url = "http://127.0.0.1:9"
+username = "admin"
+password = "offline"
+"""
 
 class TestDagsterAssets(unittest.TestCase):
     def setUp(self):
@@ -41,5 +64,100 @@ class TestDagsterAssets(unittest.TestCase):
         res = update_couchdb()
         self.assertIsNotNone(res)
 
+
+def member_fields(firstname: str) -> dict:
+    """Custom fields apply_member_to_doc copies into a CouchDB document."""
+    fields = {CUSTOMFIELD[name]: '' for name in ('email', 'username', 'git', 'public key', 'telephone')}
+    fields.update({CUSTOMFIELD['firstname']: firstname, CUSTOMFIELD['lastname']: 'Muster',
+                   CUSTOMFIELD['altstadt']: False, CUSTOMFIELD['neuenheim']: False})
+    return fields
+
+
+class TestAssetsOffline(unittest.TestCase):
+    """Assets against FakeOpenProject and an in-memory CouchDB, the module clients get an offline config."""
+
+    @classmethod
+    def setUpClass(cls):
+        with tempfile.NamedTemporaryFile('w', suffix='.toml', delete=False) as f:
+            f.write(OFFLINE_CONFIG)
+        try:
+            with patch.dict(os.environ, {'ONBOARDING_CONFIG': f.name}):
+                cls.assets = importlib.import_module('dg_openheidelberg.defs.assets')
+        finally:
+            os.unlink(f.name)
+
+    def setUp(self):
+        self.server = FakeOpenProject().start()
+        self.wp = WorkPackageParser(self.server.config())
+
+    def tearDown(self):
+        self.server.stop()
+
+    def add_member(self, firstname: str, **kwargs) -> dict:
+        member = self.server.add_work_package(**{**member_fields(firstname), **kwargs})
+        member['_links'][CUSTOMFIELD['training']] = {'href': None}
+        return member
+
+    def test_update_couchdb_skips_invalid_member_ids(self):
+        anna = self.add_member('Anna')
+        db = FakeDatabase([{'_id': 'anna', 'member_id': anna['id']},
+                           {'_id': 'broken', 'member_id': 'n/a'}])
+        with patch.object(self.assets, 'Client', return_value=offline_client(db)), \
+                patch.object(self.assets, 'WorkPackageParser', return_value=self.wp), \
+                patch('builtins.print'):
+            result = self.assets.update_couchdb()
+        self.assertIn("'invalid_member_id': 1", result)
+        self.assertEqual(db.docs['anna']['firstname'], 'Anna')
+        self.assertNotIn('firstname', db.docs['broken'])
+        self.assertEqual(db.docs[CHECKPOINT_DOC]['openproject_updated_at'], anna['updatedAt'])
+
+    def test_propagate_couchdb_changes_keeps_checkpoint_on_failure(self):
+        anna = self.add_member('Anna', status='In progress')
+        db = FakeDatabase([{'_id': 'anna', 'member_id': anna['id']}])
+        with patch.object(self.assets, 'Client', return_value=offline_client(db)), \
+                patch.object(self.assets, 'wp', self.wp), patch('builtins.print'):
+            with patch.object(self.wp, 'update_member', return_value={'error': "Failed to update member"}):
+                self.assertEqual(self.assets.propagate_couchdb_changes()['failed'], 1)
+            self.assertNotIn(CHECKPOINT_DOC, db.docs)
+            self.assertEqual(self.assets.propagate_couchdb_changes()['updated'], 1)
+        self.assertEqual(db.docs[CHECKPOINT_DOC]['changes_since'], 1)
+        self.assertEqual(self.server.work_packages[anna['id']]['subject'], 'anna')
+
+    def test_create_member_tasks_loads_logins_only_to_generate_usernames(self):
+        self.server.add_user('amuster', firstName='Anna', lastName='Muster')
+        db = FakeDatabase([{'_id': 'bmeier', 'username': 'bmeier', 'firstname': 'Bernd', 'lastname': 'Meier'}])
+        db.find = lambda query, wrapper: [dict(doc) for doc in db.docs.values()
+                                          if 'member_id' not in doc and not doc['_id'].startswith('_local/')]
+        nextcloud = MagicMock()
+        nextcloud.get_user_ids.return_value = ['amuster2']
+        with patch.object(self.assets, 'Client', return_value=offline_client(db)), \
+                patch.object(self.assets, 'wp', self.wp), \
+                patch.object(self.assets, 'up', UserParser(self.server.config())), \
+                patch.object(self.assets, 'next_client', nextcloud), patch('builtins.print'):
+            self.assets.create_openproject_member_tasks()
+            self.assertFalse(any('/api/v3/users' in request for request in self.server.requests))
+            nextcloud.get_user_ids.assert_not_called()
+            db.save({'_id': 'amuster', 'firstname': 'Anna', 'lastname': 'Muster'})
+            self.assets.create_openproject_member_tasks()
+        nextcloud.get_user_ids.assert_called_once_with()
+        nextcloud.directory.user_ids.assert_not_called()
+        self.assertEqual(db.docs['amuster']['username'], 'amuster3')
+        self.assertIn('member_id', db.docs['bmeier'])
+
+    def test_provision_account_keeps_status_when_a_step_fails(self):
+        task = self.add_member('Anna', status='Scheduled', **{
+            CUSTOMFIELD['openproject']: True, CUSTOMFIELD['username']: 'amuster',
+            CUSTOMFIELD['email']: 'anna@example.org'})
+        writer = MagicMock()
+        writer.save.side_effect = IOError("CouchDB unavailable")
+        with patch.object(self.assets, 'wp', self.wp), \
+                patch.object(self.assets, 'up', UserParser(self.server.config())), patch('builtins.print'):
+            with self.assertRaises(IOError):
+                self.assets.provision_account(self.wp.get_member(task['id']), [{'_id': 'amuster'}], writer)
+        self.assertEqual(self.server.status_id(task), STATUS['Scheduled'])
+        self.assertEqual(len(self.server.activities[task['id']]), 1)
+        self.assertIn('amuster', self.server.activities[task['id']][0]['comment']['raw'])
+
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
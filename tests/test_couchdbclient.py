@@ -1,5 +1,7 @@
 import unittest
-from couchdbclient import Client
+from unittest.mock import patch, MagicMock
+from couchdb.http import ResourceConflict, Unauthorized
+from couchdbclient import Client, TrackedDocument, CHECKPOINT_DOC, INDEXES, INDEX_DDOC, get_field
 
 class TestCouchDBClient(unittest.TestCase):
     def setUp(self):
@@ -14,5 +16,195 @@ class TestCouchDBClient(unittest.TestCase):
         self.assertIsInstance(result, list)
 
 
+class FakeResource:
+    """Answers _find requests with $in selectors and bookmark paging"""
+
+    def __init__(self, db):
+        self.db = db
+        self.finds = 0
+        self.indexes = {}
+
+    def post_json(self, path, body=None):
+        if path == '_index':
+            exists = body['name'] in self.indexes
+            self.indexes[body['name']] = body
+            return 200, {}, {'result': 'exists' if exists else 'created'}
+        assert path == '_find'
+        self.finds += 1
+        (field, condition), = body['selector'].items()
+        matches = [doc for _, doc in sorted(self.db.docs.items())
+                   if get_field(doc, field) in condition['$in']]
+        start = int(body.get('bookmark', 0))
+        page = matches[start:start + body['limit']]
+        return 200, {}, {'docs': page, 'bookmark': str(start + len(page))}
+
+
+class FakeDatabase:
+    """In-memory stand-in for couchdb.Database"""
+
+    def __init__(self, docs=None):
+        self.docs = {doc['_id']: dict(doc) for doc in docs or []}
+        self.saves = 0
+        self.bulk_requests = 0
+        self.view_batches = []
+        self.changes_requests = 0
+        self.resource = FakeResource(self)
+
+    def get(self, doc_id, default=None):
+        doc = self.docs.get(doc_id)
+        return dict(doc) if doc is not None else default
+
+    def save(self, doc):
+        self.saves += 1
+        rev = int(self.docs.get(doc['_id'], {}).get('_rev', '0-').split('-')[0]) + 1
+        doc['_rev'] = f"{rev}-fake"
+        self.docs[doc['_id']] = dict(doc)
+        return doc['_id'], doc['_rev']
+
+    def iterview(self, name, batch, **options):
+        for start in range(0, len(self.docs), batch):
+            ids = sorted(self.docs)[start:start + batch]
+            self.view_batches.append(len(ids))
+            for doc_id in ids:
+                value = {'rev': self.docs[doc_id].get('_rev')} if name == '_all_docs' else dict(self.docs[doc_id])
+                yield MagicMock(id=doc_id, key=doc_id, value=value)
+
+    def changes(self, since=0, limit=None, include_docs=False, **options):
+        self.changes_requests += 1
+        feed = [{'seq': seq, 'id': doc['_id'], 'doc': dict(doc)}
+                for seq, doc in enumerate((self.docs[doc_id] for doc_id in sorted(self.docs)
+                                           if not doc_id.startswith('_local/')), start=1)
+                if seq > since]
+        selector = options.get('_selector', {}).get('selector', {})
+        feed = [change for change in feed
+                if all((get_field(change['doc'], key) is not None) == condition['$exists']
+                       for key, condition in selector.items())]
+        results = feed[:limit]
+        return {'results': results, 'last_seq': results[-1]['seq'] if results else since}
+
+    def update(self, docs):
+        self.bulk_requests += 1
+        results = []
+        for doc in docs:
+            stored = self.docs.get(doc['_id'])
+            if stored and stored.get('_rev') != doc.get('_rev'):
+                results.append((False, doc['_id'], ResourceConflict('Document update conflict.')))
+                continue
+            self.save(doc)
+            results.append((True, doc['_id'], doc['_rev']))
+        return results
+
+
+def offline_client(db: FakeDatabase) -> Client:
+    server = MagicMock()
+    server.__getitem__.return_value = db
+    with patch('couchdbclient.couchdb.Server', return_value=server):
+        return Client(config={'couchdb_db': 'members', 'ensure_indexes': False})
+
+
+class TestCouchDBClientOffline(unittest.TestCase):
+    def test_checkpoint_roundtrip(self):
+        db = FakeDatabase()
+        client = offline_client(db)
+        self.assertIsNone(client.get_checkpoint('openproject_updated_at'))
+        client.set_checkpoint('openproject_updated_at', '2025-03-01T10:00:00Z')
+        client.set_checkpoint('changes_since', '42-abc')
+        self.assertEqual(client.get_checkpoint('openproject_updated_at'), '2025-03-01T10:00:00Z')
+        self.assertEqual(db.docs[CHECKPOINT_DOC]['changes_since'], '42-abc')
+
+    def test_bulk_writer_batches_and_reports_conflicts(self):
+        db = FakeDatabase([{'_id': f"doc{i}", '_rev': '1-fake'} for i in range(5)])
+        client = offline_client(db)
+        with client.bulk_writer(batch_size=2) as writer:
+            for i in range(5):
+                writer.save({'_id': f"doc{i}", '_rev': '0-stale' if i == 3 else '1-fake', 'n': i})
+        self.assertEqual(db.bulk_requests, 3)
+        self.assertEqual(set(writer.conflicts), {'doc3'})
+        self.assertEqual(writer.revisions['doc4'], '2-fake')
+        self.assertEqual(db.docs['doc0']['n'], 0)
+
+    def test_bulk_writer_skips_unchanged_documents(self):
+        db = FakeDatabase([{'_id': 'anna', '_rev': '1-fake', 'email': 'anna@example.org'},
+                           {'_id': 'bernd', '_rev': '1-fake', 'email': 'bernd@example.org'}])
+        client = offline_client(db)
+        anna, bernd = (TrackedDocument(db.get(doc_id)) for doc_id in ('anna', 'bernd'))
+        anna['email'] = 'anna@example.org'
+        bernd['email'] = 'bernd@example.net'
+        self.assertEqual(bernd.changed_fields(), ['email'])
+        with client.bulk_writer() as writer:
+            writer.save(anna)
+            writer.save(bernd)
+        self.assertEqual(writer.summary(), {'saved': 1, 'skipped': 1, 'conflicts': 0, 'pending': 0})
+        self.assertEqual(db.saves, 1)
+        self.assertFalse(bernd.changed)
+
+    def test_batch_lookups(self):
+        db = FakeDatabase([
+            {'_id': 'anna', 'member_id': 1, 'email': 'anna@example.org', 'nextcloud': {'nextcloud_id': 'anna'}},
+            {'_id': 'anna2', 'member_id': 1, 'email': 'anna@example.net'},
+            {'_id': 'bernd', 'member_id': 2, 'email': 'bernd@example.org'},
+        ])
+        client = offline_client(db)
+        by_member_id = client.get_docs_by_member_ids(['1', 2, 3, 'x'])
+        self.assertEqual(sorted(by_member_id), [1, 2])
+        self.assertEqual([doc['_id'] for doc in by_member_id[1]], ['anna', 'anna2'])
+        self.assertIsInstance(by_member_id[2][0], TrackedDocument)
+        self.assertEqual(list(client.get_docs_by_nextcloud_ids(['anna', 'carla'])), ['anna'])
+        self.assertEqual(db.resource.finds, 2)
+
+    def test_find_all_follows_bookmarks(self):
+        db = FakeDatabase([{'_id': f"doc{i:02}", 'email': f"{i}@example.org"} for i in range(25)])
+        client = offline_client(db)
+        docs = list(client.find_all({'email': {'$in': [f"{i}@example.org" for i in range(25)]}}, page_size=10))
+        self.assertEqual(len(docs), 25)
+        self.assertEqual(db.resource.finds, 3)
+
+    def test_ensure_indexes_is_idempotent(self):
+        db = FakeDatabase()
+        client = offline_client(db)
+        self.assertEqual(set(client.ensure_indexes().values()), {'created'})
+        self.assertEqual(set(client.ensure_indexes().values()), {'exists'})
+        self.assertEqual(set(db.resource.indexes), set(INDEXES))
+        partial = db.resource.indexes['without-member-id']['index']
+        self.assertEqual(partial['partial_filter_selector'], {'member_id': {'$exists': False}})
+
+    def test_index_creation_failure_is_not_fatal(self):
+        db = FakeDatabase()
+        db.resource.post_json = MagicMock(side_effect=Unauthorized(('unauthorized', 'admin only')))
+        server = MagicMock()
+        server.__getitem__.return_value = db
+        with patch('couchdbclient.couchdb.Server', return_value=server):
+            client = Client(config={'couchdb_server': 'nonadmin.invalid', 'couchdb_db': 'members'})
+        self.assertIs(client.db, db)
+        db.resource.post_json.assert_called_once()
+
+    def test_check_indexes_reports_full_scans(self):
+        client = offline_client(FakeDatabase())
+        client.db.explain = lambda query: {
+            'index': {'type': 'special' if query['use_index'][1] == 'email' else 'json'}}
+        self.assertEqual(client.check_indexes(), ['email'])
+        self.assertEqual(client.mango_query('email', {})['use_index'], [INDEX_DDOC, 'email'])
+
+    def test_iter_all_docs_streams_in_batches(self):
+        db = FakeDatabase([{'_id': f"doc{i}", '_rev': '1-fake', 'email': f"{i}@example.org", 'git': 'x'}
+                           for i in range(5)])
+        client = offline_client(db)
+        docs = client.iter_all_docs(batch_size=2, fields=['email'])
+        self.assertEqual(next(docs), {'_id': 'doc0', '_rev': '1-fake', 'email': '0@example.org'})
+        self.assertEqual(db.view_batches, [2])
+        self.assertEqual(len(list(docs)), 4)
+        self.assertIsInstance(client.get_all_docs()[0], TrackedDocument)
+        self.assertEqual(list(client.iter_all_docs(include_docs=False))[0], {'_id': 'doc0', '_rev': '1-fake'})
+
+    def test_iter_changes_resumes_from_checkpoint(self):
+        db = FakeDatabase([{'_id': f"doc{i}", 'member_id': i} for i in range(5)] + [{'_id': 'new'}])
+        client = offline_client(db)
+        changed = [doc['_id'] for doc in client.iter_changes(batch_size=2, selector={'member_id': {'$exists': True}})]
+        self.assertEqual(changed, [f"doc{i}" for i in range(5)])
+        self.assertEqual(db.changes_requests, 3)
+        client.set_checkpoint('changes_since', client.changes_seq)
+        self.assertEqual(list(client.iter_changes(selector={'member_id': {'$exists': True}})), [])
+
+
 if __name__ == "__main__":
-    unittest.main()
\ No newline at end of file
+    unittest.main()
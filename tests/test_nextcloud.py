@@ -1,5 +1,14 @@
+import asyncio
+import hashlib
+import os
+import tempfile
 import unittest
-from nextcloud import NextcloudClient
+from datetime import datetime
+from urllib.parse import quote, unquote
+from niquests.exceptions import HTTPError
+from unittest.mock import patch, MagicMock, AsyncMock
+from nextcloud import NextcloudClient, AsyncNextcloudClient
+from transport import RequestExecutor
 
 class TestDagsterAssets(unittest.TestCase):
     def setUp(self):
@@ -25,3 +34,217 @@ class TestDagsterAssets(unittest.TestCase):
         self.assertIn('email', user)
         self.assertIn('displayname', user)
         self.assertIn('enabled', user)
+
+
+def fake_user(user_id, email=None, display_name=None):
+    return MagicMock(user_id=user_id,
+                     email=email or f"{user_id}@example.org",
+                     display_name=display_name or user_id.title(),
+                     enabled=True,
+                     last_login=datetime(2025, 1, 2))
+
+
+def offline_client(users, **config):
+    nc = MagicMock()
+    nc.users.get_list.return_value = [user.user_id for user in users]
+    nc.users.get_user.side_effect = lambda user_id: next(user for user in users if user.user_id == user_id)
+    with patch('nextcloud.Nextcloud', return_value=nc):
+        client = NextcloudClient(config={'url': 'https://cloud.test', 'username': 'admin', 'password': 'secret',
+                                         **config})
+    client.executor = RequestExecutor(rate_limit=1000, rate_burst=1000)
+    client.executor.sleep = lambda seconds: None
+    return client, nc
+
+
+class TestNextcloudClientOffline(unittest.TestCase):
+    def test_get_user_infos_fetches_each_user_once_in_order(self):
+        users = [fake_user(f"user{i}") for i in range(10)]
+        client, nc = offline_client(users, user_workers=4)
+        infos = client.get_user_infos()
+        self.assertEqual([user.user_id for user in infos], [f"user{i}" for i in range(10)])
+        self.assertEqual(nc.users.get_user.call_count, 10)
+
+    def test_get_users_keeps_dict_shape(self):
+        client, _ = offline_client([fake_user('anna')])
+        self.assertEqual(client.get_users(), [{'id': 'anna', 'email': 'anna@example.org', 'displayname': 'Anna',
+                                               'enabled': True, 'last_login': '2025-01-02'}])
+
+    def test_check_user_uses_cached_directory(self):
+        users = [fake_user('anna', email='shared@example.org'), fake_user('bert', email='shared@example.org',
+                                                                            display_name='Bert Meier')]
+        client, nc = offline_client(users, user_workers=1)
+        self.assertEqual(client.check_user('shared@example.org', 'nobody', 'Bert', 'Meier')['id'], 'anna')
+        self.assertEqual(client.check_user('x@example.org', 'bert', 'X', 'Y')['id'], 'bert')
+        self.assertIsNone(client.check_user('x@example.org', 'nobody', 'X', 'Y'))
+        self.assertEqual(nc.users.get_list.call_count, 1)
+
+    def test_directory_expires_and_invalidates(self):
+        users = [fake_user('anna')]
+        client, nc = offline_client(users, user_cache_ttl=60)
+        self.assertIsNotNone(client.check_user('', 'anna', '', ''))
+        client.directory.invalidate('anna')
+        self.assertIsNone(client.check_user('', 'anna', '', ''))
+        client.directory.add(client.user_dict(fake_user('carl')))
+        self.assertIsNotNone(client.check_user('carl@example.org', '', '', ''))
+        self.assertEqual(nc.users.get_list.call_count, 1)
+        with patch('nextcloud.time.monotonic', return_value=client.directory.loaded_at + 61):
+            self.assertIsNotNone(client.check_user('', 'anna', '', ''))
+        self.assertEqual(nc.users.get_list.call_count, 2)
+
+    def test_download_file_if_changed_skips_unchanged_etag(self):
+        client, nc = offline_client([])
+        node = MagicMock(etag='etag-1')
+        node.info.last_modified = datetime(2025, 3, 1)
+        nc.files.by_path.return_value = node
+        nc.files.download2stream.side_effect = lambda path, fp: fp.write(b"email\na@example.org\n")
+        with tempfile.TemporaryDirectory() as tmp:
+            local_path = os.path.join(tmp, 'data', 'user_onboarding.csv')
+            self.assertTrue(client.download_file_if_changed('user_onboarding.csv', local_path)['changed'])
+            self.assertFalse(client.download_file_if_changed('user_onboarding.csv', local_path)['changed'])
+            self.assertEqual(nc.files.download2stream.call_count, 1)
+            node.etag = 'etag-2'
+            self.assertTrue(client.download_file_if_changed('user_onboarding.csv', local_path)['changed'])
+            self.assertEqual(nc.files.download2stream.call_count, 2)
+            with open(local_path, 'rb') as f:
+                self.assertEqual(f.read(), b"email\na@example.org\n")
+            self.assertEqual(sorted(os.listdir(os.path.dirname(local_path))),
+                             ['user_onboarding.csv', 'user_onboarding.csv.version.json'])
+
+    def test_upload_file_resumes_and_reports_metrics(self):
+        client, nc = offline_client([])
+        dav = FakeDav(fail_puts=4)
+        nc._session.adapter_dav = dav
+        nc._session.user = 'admin'
+        nc._session.cfg.dav_endpoint = 'https://cloud.test/remote.php/dav'
+        data = bytes(range(256)) * 40
+        with tempfile.TemporaryDirectory() as tmp:
+            file_path = os.path.join(tmp, 'accounts.csv')
+            with open(file_path, 'wb') as f:
+                f.write(data)
+            with patch('builtins.print'):
+                with self.assertRaises(Exception):
+                    client.upload_file('accounts.csv', file_path, chunk_size=1024)
+                metrics = client.upload_file('accounts.csv', file_path, chunk_size=1024)
+        self.assertEqual(dav.files['accounts.csv'], data)
+        self.assertEqual(metrics['chunks'], 10)
+        self.assertEqual(metrics['chunks_skipped'], 1)
+        self.assertEqual(metrics['bytes'], len(data))
+        self.assertEqual(metrics['bytes_sent'], len(data) - 1024)
+        self.assertEqual(metrics['retries'], 0)
+        self.assertEqual(dav.checksums['accounts.csv'], f"SHA1:{hashlib.sha1(data).hexdigest()}")
+
+    def test_upload_file_detects_corrupted_file(self):
+        client, nc = offline_client([])
+        dav = FakeDav(corrupt=True)
+        nc._session.adapter_dav = dav
+        nc._session.user = 'admin'
+        nc._session.cfg.dav_endpoint = 'https://cloud.test/remote.php/dav'
+        with tempfile.TemporaryDirectory() as tmp:
+            file_path = os.path.join(tmp, 'accounts.csv')
+            with open(file_path, 'wb') as f:
+                f.write(b"email\na@example.org\n")
+            with self.assertRaisesRegex(IOError, "corrupted"):
+                client.upload_file('accounts.csv', file_path)
+
+
+def fake_response(status_code, content=b''):
+    response = MagicMock(status_code=status_code, content=content, headers={})
+    if status_code >= 400:
+        response.raise_for_status.side_effect = HTTPError(f"{status_code}")
+    return response
+
+
+class FakeDav:
+    """Minimal WebDAV chunked upload endpoint, the first fail_puts chunk PUTs fail,
+    corrupt flips the first byte of the assembled file."""
+    def __init__(self, fail_puts=0, corrupt=False):
+        self.uploads = {}
+        self.files = {}
+        self.checksums = {}
+        self.fail_puts = fail_puts
+        self.corrupt = corrupt
+
+    def request(self, method, path, headers=None, data=None):
+        path = unquote(path)
+        if method == 'MKCOL':
+            self.uploads[path] = {}
+            return fake_response(201)
+        if method == 'PROPFIND' and path.startswith('/files/admin/'):
+            data = self.files[path.split('/files/admin/', 1)[1]]
+            return fake_response(207, (
+                '<d:multistatus xmlns:d="DAV:" xmlns:oc="http://owncloud.org/ns"><d:response><d:propstat><d:prop>'
+                f'<d:getcontentlength>{len(data)}</d:getcontentlength>'
+                f'<oc:checksums><oc:checksum>SHA1:{hashlib.sha1(data).hexdigest().upper()} '
+                f'MD5:{hashlib.md5(data).hexdigest()}</oc:checksum></oc:checksums>'
+                '</d:prop></d:propstat></d:response></d:multistatus>').encode())
+        if method == 'PROPFIND':
+            if path not in self.uploads:
+                return fake_response(404)
+            hrefs = [path + '/'] + [f"{path}/{name}" for name in self.uploads[path]]
+            body = ''.join(f"<d:response><d:href>/remote.php/dav{quote(href)}</d:href></d:response>" for href in hrefs)
+            return fake_response(207, f'<d:multistatus xmlns:d="DAV:">{body}</d:multistatus>'.encode())
+        if method == 'MOVE':
+            folder = path.rsplit('/', 1)[0]
+            chunks = self.uploads.pop(folder)
+            target = unquote(headers['Destination']).split('/files/admin/', 1)[1]
+            self.files[target] = b''.join(chunks[name] for name in sorted(chunks))
+            if self.corrupt:
+                self.files[target] = bytes([self.files[target][0] ^ 1]) + self.files[target][1:]
+            self.checksums[target] = headers['OC-Checksum']
+            return fake_response(201)
+        return fake_response(405)
+
+    def put(self, path, data=None, headers=None):
+        folder, name = unquote(path).rsplit('/', 1)
+        if self.fail_puts and self.uploads[folder]:
+            self.fail_puts -= 1
+            return fake_response(503)
+        assert headers['OC-Checksum'] == f"SHA1:{hashlib.sha1(data).hexdigest()}"
+        self.uploads[folder][name] = data
+        return fake_response(201)
+
+
+class TestAsyncNextcloudClient(unittest.TestCase):
+    def test_concurrency_is_bounded(self):
+        users = {f"user{i}": fake_user(f"user{i}") for i in range(12)}
+        in_flight = []
+
+        async def get_user(user_id):
+            in_flight.append(1)
+            self.assertLessEqual(len(in_flight), 3)
+            await asyncio.sleep(0.01)
+            in_flight.pop()
+            return users[user_id]
+
+        nc = MagicMock()
+        nc.users.get_list = AsyncMock(return_value=list(users))
+        nc.users.get_user = AsyncMock(side_effect=get_user)
+        with patch('nextcloud.AsyncNextcloud', return_value=nc):
+            client = AsyncNextcloudClient(config={'url': 'https://cloud.test', 'username': 'admin',
+                                                  'password': 'secret', 'concurrency': 3})
+        client.executor = RequestExecutor(rate_limit=1000, rate_burst=1000)
+        result = asyncio.run(client.get_users())
+        self.assertEqual([user['id'] for user in result], list(users))
+        self.assertEqual(client.user_info(users['user0'])['nextcloud_id'], 'user0')
+
+    def test_check_user_uses_directory(self):
+        users = {'anna': fake_user('anna')}
+        nc = MagicMock()
+        nc.users.get_list = AsyncMock(side_effect=lambda: list(users))
+        nc.users.get_user = AsyncMock(side_effect=lambda user_id: users[user_id])
+        nc.users.create = AsyncMock(side_effect=lambda user_id, **kwargs: users.update({user_id: fake_user(user_id)}))
+        with patch('nextcloud.AsyncNextcloud', return_value=nc):
+            client = AsyncNextcloudClient(config={'url': 'https://cloud.test', 'username': 'admin',
+                                                  'password': 'secret', 'user_cache_ttl': 60})
+        client.executor = RequestExecutor(rate_limit=1000, rate_burst=1000)
+
+        async def scenario():
+            found = await asyncio.gather(*(client.check_user('anna@example.org', '', '', '') for _ in range(5)))
+            self.assertEqual([user['id'] for user in found], ['anna'] * 5)
+            self.assertIsNone(await client.check_user('', 'ben', '', ''))
+            await client.create_user({'username': 'ben', 'email': 'ben@example.org',
+                                      'firstname': 'Ben', 'lastname': 'B'})
+            self.assertEqual((await client.check_user('', 'ben', '', ''))['id'], 'ben')
+
+        asyncio.run(scenario())
+        self.assertEqual(nc.users.get_list.call_count, 1)
@@ -0,0 +1,59 @@
+import unittest
+import pandas as pd
+from onboarding import validate_onboarding, normalize_umlauts, generate_usernames
+
+
+class TestOnboarding(unittest.TestCase):
+    def test_normalize_umlauts(self):
+        self.assertEqual(normalize_umlauts(pd.Series(['Jürgen', 'Straße', None])).tolist(),
+                         ['Juergen', 'Strasse', pd.NA])
+
+    def test_validate_onboarding(self):
+        df = pd.DataFrame({
+            'email': ['anna@example.org', 'ANNA@example.org ', 'no-at-sign', 'a@b', None],
+            'username': ['anna', 'jürgen', 'juergen', None, 'bert'],
+            'firstname': ['Anna', 'Jürgen', '', None, 'Bert'],
+            'lastname': ['Muster', 'Groß', 'Meier', 'X', ' '],
+        })
+        self.assertEqual(validate_onboarding(df), {
+            'total_rows': 5,
+            'emails_with_data': 4,
+            'invalid_email_format': 2,
+            'duplicate_emails': 1,
+            'duplicate_usernames': 1,
+            'usernames_with_umlauts': 1,
+            'missing_firstname': 2,
+            'missing_lastname': 1,
+            'names_with_umlauts': 1,
+        })
+
+    def test_validate_onboarding_email_only(self):
+        results = validate_onboarding(pd.DataFrame({'email': ['a@example.org']}))
+        self.assertEqual(results, {'total_rows': 1, 'emails_with_data': 1, 'invalid_email_format': 0,
+                                   'duplicate_emails': 0})
+
+    def test_generate_usernames(self):
+        df = pd.DataFrame({
+            'firstname': ['Max', 'Maria', 'Jörg', 'Anna', 'Moritz'],
+            'lastname': ['Muster', 'Muster', 'Groß', 'Berg', 'Mus ter'],
+            'username': [None, '', 'Jörg', 'aberg', None],
+        })
+        result = generate_usernames(df, taken=['mmuster', 'mmuster3', 'ABERG'])
+        self.assertEqual(result['username'].tolist(), ['mmuster4', 'mmuster5', 'joerg', 'aberg', 'mmuster6'])
+        self.assertEqual(result['generated'].tolist(), [True, True, False, False, True])
+        self.assertEqual(result['clash'].tolist(), [False, False, False, True, False])
+
+    def test_generate_usernames_without_taken_logins(self):
+        df = pd.DataFrame({'firstname': ['Max', 'Max'], 'lastname': ['Muster', 'Muster']})
+        self.assertEqual(generate_usernames(df)['username'].tolist(), ['mmuster', 'mmuster2'])
+        self.assertTrue(generate_usernames(df.iloc[:0]).empty)
+
+    def test_generate_usernames_leaves_nameless_rows_blank(self):
+        df = pd.DataFrame({'firstname': [None, '', 'Max'], 'lastname': [None, ' ', 'Muster']})
+        result = generate_usernames(df, taken=['1234'])
+        self.assertTrue(result['username'][:2].isna().all())
+        self.assertEqual(result['username'][2], 'mmuster')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,11 +1,14 @@
 import sys
 import os
+import json
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
 import unittest
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
-from openproject import WorkPackageParser, UserParser, CUSTOMFIELD, STATUS
+from openproject import (WorkPackageParser, UserParser, CollectionFetcher, IncompleteCollectionError,
+                         CUSTOMFIELD, STATUS, TASK_FIELDS)
+from tests.fake_openproject import FakeOpenProject
 
 
 class TestWorkPackageParser(TestCase):
@@ -58,7 +61,7 @@ class TestWorkPackageParser(TestCase):
         member_info = self.wp.get_member(203)
         assert member_info is not None
 
-    @patch("openproject.requests.get")
+    @patch("openproject.Transport.get")
     def test_get_members(self, mock_get):
         # Test successful response
         mock_response = MagicMock()
@@ -87,7 +90,8 @@ class TestWorkPackageParser(TestCase):
                         }
                     }
                 ]
-            }
+            },
+            '_links': {}
         }
         mock_get.return_value = mock_response
 
@@ -104,29 +108,14 @@ class TestWorkPackageParser(TestCase):
         # Verify the API call was made correctly
         mock_get.assert_called_once_with(
             'https://test.openproject.com/api/v3/projects/18/work_packages',
-            auth=('apikey', 'test-api-key')
+            params={'offset': 1, 'pageSize': 20}
         )
 
         # Verify the result structure
         expected_result = {
             'total': 2,
             'count': 2,
-            'members': [
-                {
-                    'id': 1,
-                    'subject': 'Test Work Package 1',
-                    'description': 'Description for WP 1',
-                    'status': 'New',
-                    'priority': 'High'
-                },
-                {
-                    'id': 2,
-                    'subject': 'Test Work Package 2',
-                    'description': 'Description for WP 2',
-                    'status': 'In Progress',
-                    'priority': 'Normal'
-                }
-            ]
+            'members': mock_response.json.return_value['_embedded']['elements']
         }
 
         self.assertEqual(result, expected_result)
@@ -167,6 +156,242 @@ class TestWorkPackageParser(TestCase):
         # Assuming the delete operation is successful and no exception is raised
 
 
+class TestMemberIndex(TestCase):
+    def setUp(self):
+        self.wp = WorkPackageParser({'apikey': 'test-api-key', 'url': 'https://test.openproject.com'})
+        self.wp.set_members([
+            {'id': 1, 'subject': 'anna.schmidt', CUSTOMFIELD['firstname']: 'Anna',
+             CUSTOMFIELD['lastname']: 'Schmidt', CUSTOMFIELD['username']: 'aschmidt'},
+            {'id': 2, 'subject': 'bernd.meier', CUSTOMFIELD['email']: 'Bernd@Example.org',
+             CUSTOMFIELD['username']: 'bmeier'},
+        ])
+
+    def test_lookup_by_each_field(self):
+        self.assertEqual(self.wp.check_member_exists(subject='x', email='bernd@example.org ')['id'], 2)
+        self.assertEqual(self.wp.check_member_exists(subject='Anna.Schmidt', email='')['id'], 1)
+        self.assertEqual(self.wp.check_member_exists(subject='x', email='', username='BMEIER')['id'], 2)
+        self.assertEqual(self.wp.check_member_exists(subject='x', email='', firstname='anna',
+                                                     lastname='SCHMIDT')['id'], 1)
+        self.assertIsNone(self.wp.check_member_exists(subject='x', email='nobody@example.org'))
+
+    def test_first_listed_member_wins(self):
+        member = self.wp.check_member_exists(subject='x', email='bernd@example.org',
+                                             firstname='Anna', lastname='Schmidt')
+        self.assertEqual(member['id'], 1)
+
+    @patch("openproject.Transport.patch")
+    @patch("openproject.Transport.post")
+    def test_index_follows_create_and_update(self, mock_post, mock_patch):
+        mock_post.return_value = MagicMock(status_code=201, json=MagicMock(return_value={
+            'id': 3, 'subject': 'carla.roth', CUSTOMFIELD['email']: 'carla@example.org'}))
+        self.wp.create_member({'subject': 'carla.roth'})
+        self.assertEqual(self.wp.check_member_exists(subject='x', email='carla@example.org')['id'], 3)
+
+        mock_patch.return_value = MagicMock(status_code=200, text='{}', json=MagicMock(return_value={
+            'id': 2, 'subject': 'bernd.meier', CUSTOMFIELD['email']: 'bernd@example.net'}))
+        self.wp.update_member(2, {'lockVersion': 1})
+        self.assertIsNone(self.wp.check_member_exists(subject='x', email='bernd@example.org'))
+        self.assertIsNone(self.wp.check_member_exists(subject='x', email='', username='bmeier'))
+        self.assertEqual(self.wp.check_member_exists(subject='x', email='bernd@example.net')['id'], 2)
+
+
+class FakePagedTransport:
+    """Serves a collection of `total` elements, failing on the offsets in `fail`."""
+
+    def __init__(self, total, fail=()):
+        self.total = total
+        self.fail = fail
+        self.calls = []
+
+    def get(self, url, params=None):
+        self.calls.append(params)
+        offset, size = params['offset'], params['pageSize']
+        if offset in self.fail:
+            return MagicMock(status_code=500)
+        # the server may clamp pageSize, like OpenProject does
+        size = min(size, 10)
+        ids = range((offset - 1) * size, min(offset * size, self.total))
+        page = {'total': self.total, 'pageSize': size, 'offset': offset,
+                '_embedded': {'elements': [{'id': i} for i in ids]}}
+        return MagicMock(status_code=200, json=MagicMock(return_value=page))
+
+
+class TestCollectionFetcher(TestCase):
+    def test_fetch_all_keeps_order(self):
+        transport = FakePagedTransport(total=95)
+        fetcher = CollectionFetcher(transport, page_size=50, workers=4)
+        result = fetcher.fetch_all('https://test/api/v3/users', params={'filters': '[]'})
+        self.assertEqual(result['total'], 95)
+        self.assertEqual([e['id'] for e in result['elements']], list(range(95)))
+        self.assertEqual(len(transport.calls), 10)
+        self.assertTrue(all(call['filters'] == '[]' for call in transport.calls))
+        self.assertEqual(fetcher.metrics()['pages'], 10)
+
+    def test_iter_pages_prefetch_is_bounded(self):
+        transport = FakePagedTransport(total=100)
+        fetcher = CollectionFetcher(transport, page_size=10, workers=2)
+        pages = fetcher.iter_pages('https://test/api/v3/users')
+        self.assertEqual(next(pages)['offset'], 1)
+        self.assertEqual(next(pages)['offset'], 2)
+        pages.close()
+        # first page, the page consumed and at most `workers` pages ahead of it
+        self.assertLessEqual(len(transport.calls), 4)
+
+    def test_fetch_all_stops_at_failed_page(self):
+        fetcher = CollectionFetcher(FakePagedTransport(total=35, fail=(3,)), page_size=10)
+        result = fetcher.fetch_all('https://test/api/v3/users')
+        self.assertEqual([e['id'] for e in result['elements']], list(range(20)))
+
+    def test_strict_iteration_raises_on_failed_page(self):
+        fetcher = CollectionFetcher(FakePagedTransport(total=30, fail=(2,)), page_size=10)
+        seen = []
+        with self.assertRaises(IncompleteCollectionError):
+            for element in fetcher.iter_elements('https://test/api/v3/work_packages', strict=True):
+                seen.append(element['id'])
+        self.assertEqual(seen, list(range(10)))
+        with self.assertRaises(IncompleteCollectionError):
+            list(CollectionFetcher(FakePagedTransport(total=30, fail=(1,))).iter_elements('https://test', strict=True))
+
+
+class TestWorkPackageQuery(TestCase):
+    def setUp(self):
+        self.wp = WorkPackageParser({'apikey': 'test-api-key', 'url': 'https://test.openproject.com'})
+
+    def test_build_filters(self):
+        self.assertEqual(self.wp.build_filters(ids=[203, 237]), [{'id': {'operator': '=', 'values': ['203', '237']}}])
+        filters = self.wp.build_filters(status_ids=[6, 7],
+                                        updated_after='2025-01-01T00:00:00Z',
+                                        custom_fields={CUSTOMFIELD['nextcloud']: True,
+                                                       CUSTOMFIELD['username']: ['anna', 'bernd']})
+        self.assertEqual(filters, [
+            {'status': {'operator': '=', 'values': ['6', '7']}},
+            {'updatedAt': {'operator': '<>d', 'values': ['2025-01-01T00:00:00Z', '']}},
+            {CUSTOMFIELD['nextcloud']: {'operator': '=', 'values': ['t']}},
+            {CUSTOMFIELD['username']: {'operator': '=', 'values': ['anna', 'bernd']}},
+        ])
+
+    def test_get_workpackages_follows_all_pages(self):
+        transport = FakePagedTransport(total=25)
+        self.wp.fetcher = CollectionFetcher(transport, page_size=10)
+        tasks = self.wp.get_workpackages(project_id=18, status_id=STATUS['Scheduled'], select=['id', 'lockVersion'])
+        self.assertEqual(len(tasks), 25)
+        self.assertEqual(len(transport.calls), 3)
+        params = transport.calls[0]
+        self.assertEqual(json.loads(params['filters']), [{'status': {'operator': '=', 'values': ['6']}}])
+        self.assertEqual(params['select'], 'total,count,elements/id,elements/lockVersion')
+
+    def test_incremental_query_is_sorted_and_strict(self):
+        transport = FakePagedTransport(total=30, fail=(2,))
+        self.wp.fetcher = CollectionFetcher(transport, page_size=10)
+        changed = self.wp.iter_workpackages(project_id=18, updated_after='2025-01-01T00:00:00Z',
+                                            sort_by=[('updatedAt', 'asc'), ('id', 'asc')], strict=True)
+        with self.assertRaises(IncompleteCollectionError):
+            list(changed)
+        self.assertEqual(json.loads(transport.calls[0]['sortBy']), [['updatedAt', 'asc'], ['id', 'asc']])
+
+
+class TestWorkPackageChanges(TestCase):
+    def setUp(self):
+        self.wp = WorkPackageParser({'apikey': 'test-api-key', 'url': 'https://test.openproject.com'})
+
+    @patch("openproject.Transport.patch")
+    @patch("openproject.Transport.post")
+    def test_changes_are_sent_once(self, mock_post, mock_patch):
+        mock_patch.return_value = MagicMock(status_code=200, text='{}', json=MagicMock(return_value={
+            'id': 7, 'subject': 'anna.schmidt', 'lockVersion': 4}))
+        mock_post.return_value = MagicMock(status_code=201, json=MagicMock(return_value={'id': 99}))
+        task = {'id': 7, 'lockVersion': 3}
+        changes = self.wp.changes(task)
+        changes.add_comment("created in OpenProject")
+        changes.set_status('In specification')
+        changes.add_comment("created in Nextcloud")
+        changes.set_status('In progress')
+        changes.set_field(CUSTOMFIELD['nextcloud'], True)
+        changes.commit()
+
+        self.assertEqual(mock_patch.call_count, 1)
+        self.assertEqual(json.loads(mock_patch.call_args.kwargs['data']), {
+            'lockVersion': 3,
+            '_links': {'status': {'href': f"/api/v3/statuses/{STATUS['In progress']}"}},
+            CUSTOMFIELD['nextcloud']: True})
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertEqual(json.loads(mock_post.call_args.kwargs['data']),
+                         {'comment': {'raw': "created in OpenProject\n\ncreated in Nextcloud"}})
+        self.assertEqual(task['lockVersion'], 4)
+        self.assertEqual(changes.commit(), {})
+        self.assertEqual(mock_patch.call_count, 1)
+
+    @patch("openproject.Transport.get")
+    @patch("openproject.Transport.patch")
+    def test_conflict_is_resolved_with_fresh_lock_version(self, mock_patch, mock_get):
+        mock_patch.side_effect = [
+            MagicMock(status_code=409, text='{}'),
+            MagicMock(status_code=200, text='{}', json=MagicMock(return_value={'id': 7, 'lockVersion': 6})),
+            MagicMock(status_code=409, text='{}'),
+            MagicMock(status_code=409, text='{}'),
+        ]
+        mock_get.return_value = MagicMock(status_code=200, json=MagicMock(return_value={'id': 7, 'lockVersion': 5}))
+        task = {'id': 7, 'lockVersion': 3}
+        self.wp.update_status(task, 'In progress')
+        retried = json.loads(mock_patch.call_args_list[1].kwargs['data'])
+        self.assertEqual(retried['lockVersion'], 5)
+        self.assertEqual(retried['_links'], {'status': {'href': f"/api/v3/statuses/{STATUS['In progress']}"}})
+        self.assertEqual(task['lockVersion'], 6)
+
+        self.assertIn('error', self.wp.update_member(7, {'lockVersion': 6}))
+        self.assertEqual(self.wp.conflict_metrics(), {'updates': 2, 'conflicts': 2, 'resolved': 1, 'failed': 1,
+                                                      'conflict_rate': 1.0})
+
+
+class TestAgainstFakeOpenProject(TestCase):
+    def setUp(self):
+        self.server = FakeOpenProject().start()
+        self.wp = WorkPackageParser(self.server.config(page_size=20))
+        self.up = UserParser(self.server.config(page_size=20))
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_workpackages_follow_pagination_and_filters(self):
+        self.server.add_work_packages(45, status='Scheduled', **{CUSTOMFIELD['nextcloud']: True})
+        self.server.add_work_packages(5, status='In progress')
+        self.server.add_work_packages(3, status='Closed')
+        tasks = self.wp.get_workpackages(project_id=18, status_id=STATUS['Scheduled'], select=TASK_FIELDS)
+        self.assertEqual(len(tasks), 45)
+        self.assertEqual(set(tasks[0]), set(TASK_FIELDS))
+        self.assertEqual(self.wp.fetcher.metrics()['pages'], 3)
+        # without filters only open work packages are listed, like in OpenProject
+        self.assertEqual(self.wp.get_members()['total'], 50)
+        page = self.wp.transport.get(f"{self.server.url}/api/v3/work_packages", params={'pageSize': 20}).json()
+        self.assertIn('nextByOffset', page['_links'])
+
+    def test_concurrent_edit_is_resolved(self):
+        task = self.server.add_work_package(status='Scheduled')
+        member = self.wp.get_member(task['id'])
+        self.server.touch(task['id'])
+        changes = self.wp.changes(member)
+        changes.set_status('In progress')
+        changes.add_comment("accounts created")
+        changes.commit()
+        self.assertEqual(self.server.conflicts, 1)
+        self.assertEqual(self.server.status_id(self.server.work_packages[task['id']]), STATUS['In progress'])
+        self.assertEqual(member['lockVersion'], 2)
+        self.assertEqual([a['comment']['raw'] for a in self.server.activities[task['id']]], ["accounts created"])
+
+    def test_users(self):
+        self.server.add_user('aschmidt', firstName='Anna', lastName='Schmidt')
+        user = self.up.create_new_user({CUSTOMFIELD['firstname']: 'Bernd', CUSTOMFIELD['lastname']: 'Meier',
+                                        CUSTOMFIELD['username']: 'bmeier', CUSTOMFIELD['email']: 'b@example.org'})
+        self.assertEqual(user['login'], 'bmeier')
+        self.assertEqual(self.up.create_new_user({CUSTOMFIELD['username']: 'bmeier'}), {})
+        self.assertEqual([u['login'] for u in self.up.iter_users()], ['aschmidt', 'bmeier'])
+        self.assertEqual(self.up.get_user(user['id'])['email'], 'b@example.org')
+
+    def test_wrong_apikey_is_rejected(self):
+        wp = WorkPackageParser({**self.server.config(), 'apikey': 'wrong'})
+        self.assertIsNone(wp.get_member(1))
+
+
 class TestUserParser(TestCase):
     def setUp(self):
         # Initialize client with real config
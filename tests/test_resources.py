@@ -0,0 +1,37 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+import tempfile
+import unittest
+import dagster as dg
+import pandas as pd
+from dg_openheidelberg.defs.resources import ParquetIOManager
+
+
+@dg.asset(io_manager_key="parquet_io_manager", metadata={"dtypes": {"email": "string", "age": "Int64"}})
+def onboarding():
+    return pd.DataFrame({"email": ["a@example.org", None], "age": [30, None], "note": ["x", "y"]})
+
+
+@dg.asset(ins={"onboarding": dg.AssetIn(metadata={"columns": ["email", "age"]})})
+def emails(onboarding: pd.DataFrame):
+    return onboarding
+
+
+class TestParquetIOManager(unittest.TestCase):
+    def test_typed_roundtrip_with_column_selection(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            result = dg.materialize([onboarding, emails],
+                                    resources={"parquet_io_manager": ParquetIOManager(base_dir=tmp)})
+            self.assertTrue(result.success)
+            self.assertTrue(os.path.exists(os.path.join(tmp, "onboarding.parquet")))
+            df = result.output_for_node("emails")
+            self.assertEqual(list(df.columns), ["email", "age"])
+            self.assertEqual(str(df["email"].dtype), "string")
+            self.assertEqual(str(df["age"].dtype), "Int64")
+            self.assertTrue(pd.isna(df["age"][1]))
+
+
+if __name__ == "__main__":
+    unittest.main()
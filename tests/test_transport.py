@@ -0,0 +1,128 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+import threading
+import unittest
+import niquests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock
+from transport import Transport, RequestExecutor, TokenBucket
+
+
+class OkHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    statuses = []
+
+    def do_GET(self):
+        body = b'{}'
+        status = self.statuses.pop(0) if self.statuses else 200
+        self.send_response(status)
+        if status == 429:
+            self.send_header('Retry-After', '0')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestTransport(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), OkHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_for_config_shares_instance(self):
+        config = {'url': self.url, 'apikey': 'shared-key', 'pool_size': 2}
+        self.assertIs(Transport.for_config(config), Transport.for_config(dict(config)))
+        other = Transport.for_config({'url': self.url, 'apikey': 'other-key'})
+        self.assertIsNot(Transport.for_config(config), other)
+
+    def test_connections_are_reused(self):
+        transport = Transport(auth=('apikey', 'test'), read_timeout=5)
+        for _ in range(5):
+            response = transport.get(f"{self.url}/api/v3")
+            self.assertEqual(response.status_code, 200)
+        stats = transport.stats()
+        self.assertEqual(stats['requests'], 5)
+        self.assertEqual(stats['connections_opened'], 1)
+        self.assertEqual(stats['connections_reused'], 4)
+        transport.close()
+
+    def test_request_retries_throttled_response(self):
+        OkHandler.statuses = [429, 503]
+        transport = Transport(auth=('apikey', 'test'), read_timeout=5)
+        transport.executor.sleep = lambda seconds: None
+        response = transport.get(f"{self.url}/api/v3")
+        self.assertEqual(response.status_code, 200)
+        stats = transport.stats()
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['retries'], 2)
+        transport.close()
+
+
+def response(status_code, headers=None):
+    return MagicMock(status_code=status_code, headers=headers or {})
+
+
+class TestRequestExecutor(unittest.TestCase):
+    def setUp(self):
+        self.executor = RequestExecutor(rate_limit=1000, rate_burst=1000, backoff=1, max_backoff=4)
+        self.delays = []
+        self.executor.sleep = self.delays.append
+
+    def test_backoff_honors_retry_after(self):
+        responses = [response(429, {'Retry-After': '7'}), response(502), response(502), response(200)]
+        result = self.executor.execute(lambda: responses.pop(0))
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(self.delays[0], 7)
+        self.assertTrue(1 <= self.delays[1] <= 2 <= self.delays[2] <= 4)
+
+    def test_non_idempotent_calls_only_retry_unprocessed_requests(self):
+        responses = [response(503), response(500), response(200)]
+        self.assertEqual(self.executor.execute(lambda: responses.pop(0), idempotent=False).status_code, 500)
+        error = ConnectionError("reset")
+        calls = []
+
+        def send():
+            calls.append(1)
+            raise error
+        with self.assertRaises(ConnectionError):
+            self.executor.execute(send, idempotent=False)
+        self.assertEqual(len(calls), 1)
+
+    def test_niquests_network_errors_are_retried(self):
+        errors = [niquests.exceptions.ConnectionError("reset"), niquests.exceptions.ReadTimeout("slow")]
+
+        def send():
+            if errors:
+                raise errors.pop(0)
+            return response(200)
+        self.assertEqual(self.executor.execute(send).status_code, 200)
+        self.assertEqual(self.executor.metrics['retries'], 2)
+
+    def test_retry_budget_limits_retries(self):
+        executor = RequestExecutor(rate_limit=1000, rate_burst=1000, max_retries=10, retry_ratio=0.5, retry_capacity=3)
+        executor.sleep = lambda seconds: None
+        self.assertEqual(executor.execute(lambda: response(503)).status_code, 503)
+        self.assertEqual(executor.metrics['retries'], 3)
+        self.assertEqual(executor.metrics['budget_exhausted'], 1)
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=10, burst=2)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertAlmostEqual(bucket.reserve(), 0.1, places=2)
+        self.assertAlmostEqual(bucket.reserve(), 0.2, places=2)
+
+
+if __name__ == "__main__":
+    unittest.main()